@@ -23,6 +23,9 @@ class Settings(BaseSettings):
     otp_rate_limit_seconds: int = Field(default=30)
     otp_max_attempts: int = Field(default=5)
 
+    # Rate limit compartido entre workers (opcional: requiere el paquete redis)
+    redis_url: str = Field(default="")
+
     # Auth (Fase 2)
     auth_secret: str = Field(default="dev-secret-cambia-esto")
     auth_token_ttl_seconds: int = Field(default=86400)  # 24h
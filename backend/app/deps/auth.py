@@ -1,13 +1,14 @@
 # backend/app/deps/auth.py
 from __future__ import annotations
 
+import time
 from dataclasses import dataclass
-from typing import Optional
+from typing import Dict, Optional, Tuple
 
 from fastapi import Depends, HTTPException, status
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 
-from ..utils.tokens import verify as verify_token
+from ..utils.tokens import token_key, verify as verify_token
 from ..repo import usuarios as usuarios_repo
 
 # <-- Esto hace que FastAPI registre el esquema Bearer en OpenAPI,
@@ -15,11 +16,21 @@ from ..repo import usuarios as usuarios_repo
 security = HTTPBearer(auto_error=False)
 
 
-@dataclass
+@dataclass(frozen=True)
 class UserCtx:
     user_id: str
     email: str
-    is_admin: bool = False
+    es_admin: bool = False
+
+
+# Caché de tokens ya verificados:
+#   token_key(token) -> (caduca_monotonic, gen_perfiles, marca_perfiles, ctx).
+# Evita repetir HMAC + JSON + lectura del perfil en cada petición del frontend.
+# Cualquier escritura de perfil la invalida: las de este proceso por el contador
+# y las de otros workers o scripts (p. ej. un cambio de rol) por la marca en disco.
+_TOKEN_CACHE: Dict[bytes, Tuple[float, int, bytes, UserCtx]] = {}
+_TOKEN_CACHE_MAX = 4096
+_TOKEN_CACHE_TTL_S = 30.0
 
 
 async def get_current_user(
@@ -36,7 +47,18 @@ async def get_current_user(
         )
 
     token = credentials.credentials
-    ok, data = verify_token(token)
+    key = token_key(token)
+    ahora = time.monotonic()
+    hit = _TOKEN_CACHE.get(key)
+    if (
+        hit is not None
+        and hit[0] > ahora
+        and hit[1] == usuarios_repo._PERFILES_GEN
+        and hit[2] == usuarios_repo.perfiles_marca()
+    ):
+        return hit[3]
+
+    ok, data = verify_token(token, key)
     if not ok:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
@@ -53,18 +75,35 @@ async def get_current_user(
             headers={"WWW-Authenticate": "Bearer"},
         )
 
+    # Se lee el perfil una sola vez por petición: las comprobaciones de admin
+    # posteriores solo consultan ``user.es_admin``.
+    # Contador y marca se leen antes que el perfil: una escritura posterior
+    # siempre invalida la entrada
+    gen = usuarios_repo._PERFILES_GEN
+    marca = usuarios_repo.perfiles_marca()
     perfil = usuarios_repo.get_perfil(user_id) or {}
-    is_admin = bool(perfil.get("es_admin", False))
-    return UserCtx(user_id=user_id, email=email, is_admin=is_admin)
+    es_admin = bool(perfil.get("es_admin", False)) and not bool(perfil.get("eliminado", False))
+    ctx = UserCtx(user_id=user_id, email=email, es_admin=es_admin)
+
+    # Nunca más allá del 'exp' del propio token
+    vida = _TOKEN_CACHE_TTL_S
+    exp = data.get("exp")
+    if exp:
+        vida = min(vida, float(exp) - time.time())
+    if vida > 0:
+        if len(_TOKEN_CACHE) >= _TOKEN_CACHE_MAX:
+            # dict conserva el orden de inserción: fuera la entrada más antigua
+            _TOKEN_CACHE.pop(next(iter(_TOKEN_CACHE)), None)
+        _TOKEN_CACHE[key] = (ahora + vida, gen, marca, ctx)
+    return ctx
 
 
 async def require_admin(user: UserCtx = Depends(get_current_user)) -> UserCtx:
     """
     Dependencia para endpoints de admin.
+    Usa el ``es_admin`` calculado en get_current_user (FastAPI resuelve esa
+    dependencia una sola vez por petición), sin volver a leer el perfil.
     """
-    if not usuarios_repo.user_exists(user.user_id):
-        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Usuario no encontrado")
-    perfil = usuarios_repo.get_perfil(user.user_id) or {}
-    if not bool(perfil.get("es_admin", False)):
+    if not user.es_admin:
         raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Acceso restringido a administradores")
     return user
@@ -0,0 +1,68 @@
+# backend/app/deps/etag.py
+from __future__ import annotations
+
+import os
+from email.utils import parsedate
+from hashlib import blake2b
+from typing import Any
+
+import orjson
+from fastapi import Request, Response
+from fastapi.responses import FileResponse
+from starlette.datastructures import Headers
+
+
+def _coincide_etag(if_none_match: str, etag: str) -> bool:
+    if if_none_match.strip() == "*":
+        return True
+    return etag in (t.strip().removeprefix("W/") for t in if_none_match.split(","))
+
+
+def _no_modificado(request: Request, headers: Headers) -> bool:
+    """Misma lógica que StaticFiles.is_not_modified (If-None-Match manda)."""
+    inm = request.headers.get("if-none-match")
+    if inm is not None:
+        return _coincide_etag(inm, headers.get("etag", ""))
+    ims = request.headers.get("if-modified-since")
+    lm = headers.get("last-modified")
+    if ims and lm:
+        a, b = parsedate(ims), parsedate(lm)
+        return a is not None and b is not None and a >= b
+    return False
+
+
+def _not_modified(headers: Headers) -> Response:
+    keep = {k: v for k, v in headers.items() if k in ("etag", "last-modified", "cache-control")}
+    return Response(status_code=304, headers=keep)
+
+
+def etag_response(request: Request, payload: Any) -> Response:
+    """Serializa ``payload`` a JSON con ETag (blake2b del cuerpo).
+
+    Si el cliente ya tiene esa versión (If-None-Match) devuelve 304 sin cuerpo.
+    """
+    return etag_json_response(request, orjson.dumps(payload))
+
+
+def etag_json_response(request: Request, body: bytes) -> Response:
+    """Como etag_response, para un JSON que ya viene serializado."""
+    etag = '"' + blake2b(body, digest_size=16).hexdigest() + '"'
+    headers = {"ETag": etag, "Cache-Control": "no-cache"}
+    inm = request.headers.get("if-none-match")
+    if inm is not None and _coincide_etag(inm, etag):
+        return Response(status_code=304, headers=headers)
+    return Response(content=body, media_type="application/json", headers=headers)
+
+
+def file_response(request: Request, path: str, media_type: str, cache_control: str = "no-cache") -> Response:
+    """FileResponse con 304 si el fichero no ha cambiado (ETag/Last-Modified
+    que Starlette calcula a partir de mtime y tamaño)."""
+    resp = FileResponse(
+        path,
+        media_type=media_type,
+        headers={"Cache-Control": cache_control},
+        stat_result=os.stat(path),
+    )
+    if _no_modificado(request, resp.headers):
+        return _not_modified(resp.headers)
+    return resp
@@ -1,34 +1,117 @@
 from __future__ import annotations
 
 import asyncio
+import logging
 import smtplib
 from email.message import EmailMessage
-from typing import Optional
+from typing import Any, Dict, Iterable, List, NamedTuple, Optional, Tuple
 
 from .repo import ajustes as ajustes_repo
 
+logger = logging.getLogger(__name__)
 
-def _send_email_sync(to_email: str, subject: str, body: str) -> None:
-    cfg = ajustes_repo.get_smtp_runtime()
-    msg = EmailMessage()
-    msg["Subject"] = subject
-    msg["From"] = cfg["from"]
-    msg["To"] = to_email
-    msg.set_content(body)
 
-    if cfg["use_starttls"]:
-        with smtplib.SMTP(cfg["host"], cfg["port"]) as s:
+class _Correo(NamedTuple):
+    to: Tuple[str, ...]
+    subject: str
+    body: str
+
+
+# Cola de correos: un único worker los envía reutilizando una sesión SMTP por lote
+_QUEUE_MAX = 1000
+_LOTE_MAX = 50
+
+_loop: Optional[asyncio.AbstractEventLoop] = None
+_queue: Optional[asyncio.Queue] = None
+_worker: Optional[asyncio.Task] = None
+
+
+def _smtp_session(cfg: Dict[str, Any]) -> smtplib.SMTP:
+    s = smtplib.SMTP(cfg["host"], cfg["port"]) if cfg["use_starttls"] else smtplib.SMTP_SSL(cfg["host"], cfg["port"])
+    try:
+        if cfg["use_starttls"]:
             s.ehlo()
             s.starttls()
             s.ehlo()
-            if cfg["username"] and cfg["password"]:
-                s.login(cfg["username"], cfg["password"])
-            s.send_message(msg)
-    else:
-        with smtplib.SMTP_SSL(cfg["host"], cfg["port"]) as s:
-            if cfg["username"] and cfg["password"]:
-                s.login(cfg["username"], cfg["password"])
-            s.send_message(msg)
+        if cfg["username"] and cfg["password"]:
+            s.login(cfg["username"], cfg["password"])
+    except Exception:
+        s.close()
+        raise
+    return s
+
+
+def _mensaje(cfg: Dict[str, Any], correo: _Correo) -> EmailMessage:
+    msg = EmailMessage()
+    msg["Subject"] = correo.subject
+    msg["From"] = cfg["from"]
+    # Varios destinatarios: van en copia oculta (sobre SMTP) y no se ven entre sí
+    msg["To"] = correo.to[0] if len(correo.to) == 1 else cfg["from"]
+    msg.set_content(correo.body)
+    return msg
+
+
+def _cerrar(s: Optional[smtplib.SMTP]) -> None:
+    if s is None:
+        return
+    try:
+        s.quit()
+    except Exception:
+        s.close()
+
+
+def _enviar(s: smtplib.SMTP, cfg: Dict[str, Any], correo: _Correo) -> None:
+    rechazados = s.send_message(_mensaje(cfg, correo), to_addrs=list(correo.to))
+    if rechazados:
+        # Rechazo parcial: el resto de destinatarios sí lo ha recibido
+        logger.warning("Destinatarios rechazados para %r: %s", correo.subject, ", ".join(rechazados))
+
+
+def _conectada(s: smtplib.SMTP) -> bool:
+    try:
+        return s.noop()[0] == 250
+    except Exception:
+        return False
+
+
+def _send_many_sync(correos: List[_Correo]) -> None:
+    """
+    Envía un lote con una sola sesión SMTP. Un correo que falla se registra y
+    no impide enviar los siguientes; si se cae la conexión se reabre la sesión
+    y se reintenta ese correo una vez.
+    """
+    cfg = ajustes_repo.get_smtp_runtime()
+    s: Optional[smtplib.SMTP] = None
+    try:
+        for i, correo in enumerate(correos):
+            if s is None:
+                try:
+                    s = _smtp_session(cfg)
+                except Exception:
+                    logger.exception("No se pudo abrir la sesión SMTP; %d correos sin enviar", len(correos) - i)
+                    return
+            try:
+                try:
+                    _enviar(s, cfg, correo)
+                except smtplib.SMTPServerDisconnected:
+                    s.close()
+                    s = None  # si no se puede reabrir, el siguiente correo lo reintenta
+                    s = _smtp_session(cfg)
+                    _enviar(s, cfg, correo)
+            except Exception:
+                logger.exception("No se pudo enviar el correo %r a %s", correo.subject, ", ".join(correo.to))
+                if s is not None and not _conectada(s):
+                    s.close()
+                    s = None
+    finally:
+        _cerrar(s)
+
+
+def _send_email_sync(to_email: str, subject: str, body: str) -> None:
+    # Envío directo (correo de prueba): los errores llegan al llamador
+    cfg = ajustes_repo.get_smtp_runtime()
+    with _smtp_session(cfg) as s:
+        _enviar(s, cfg, _Correo((to_email,), subject, body))
 
 
 async def send_email(to_email: str, subject: str, body: str) -> None:
@@ -37,3 +120,80 @@ async def send_email(to_email: str, subject: str, body: str) -> None:
 
 async def send_test_email(to_email: str) -> None:
     await send_email(to_email, "Prueba SMTP", "Este es un correo de prueba del Panel.")
+
+
+async def _enviar_lote(lote: List[_Correo]) -> None:
+    try:
+        await asyncio.to_thread(_send_many_sync, lote)
+    except Exception:
+        # Un fallo inesperado no debe tumbar el worker; el siguiente lote reconecta
+        logger.exception("Error enviando un lote de %d correos", len(lote))
+
+
+async def _email_worker() -> None:
+    assert _queue is not None
+    while True:
+        lote = [await _queue.get()]
+        while len(lote) < _LOTE_MAX and not _queue.empty():
+            lote.append(_queue.get_nowait())
+        await _enviar_lote(lote)
+
+
+async def start_email_worker() -> None:
+    """Arranca el worker de correo en el event loop actual (startup)."""
+    global _loop, _queue, _worker
+    if _worker is not None:
+        return
+    _loop = asyncio.get_running_loop()
+    _queue = asyncio.Queue(maxsize=_QUEUE_MAX)
+    _worker = _loop.create_task(_email_worker())
+
+
+async def stop_email_worker() -> None:
+    """Para el worker y envía lo que quede en la cola (shutdown)."""
+    global _loop, _queue, _worker
+    if _worker is None:
+        return
+    _worker.cancel()
+    try:
+        await _worker
+    except asyncio.CancelledError:
+        pass
+    pendientes: List[_Correo] = []
+    while _queue is not None and not _queue.empty():
+        pendientes.append(_queue.get_nowait())
+    _loop = _queue = _worker = None
+    if pendientes:
+        await _enviar_lote(pendientes)
+
+
+def _encolar(correo: _Correo) -> None:
+    if _queue is None:
+        return
+    try:
+        _queue.put_nowait(correo)
+    except asyncio.QueueFull:
+        pass
+
+
+def enqueue_email(to: Iterable[str], subject: str, body: str) -> None:
+    """Encola un correo (uno o varios destinatarios) sin esperar al envío."""
+    correo = _Correo(tuple(to), subject, body)
+    if not correo.to:
+        return
+    loop = _loop
+    if loop is None:
+        # Sin worker (scripts, tests): tarea suelta como antes, si hay loop
+        try:
+            asyncio.get_running_loop().create_task(_enviar_lote([correo]))
+        except RuntimeError:
+            pass
+        return
+    try:
+        en_loop = asyncio.get_running_loop() is loop
+    except RuntimeError:
+        en_loop = False
+    if en_loop:
+        _encolar(correo)
+    else:
+        loop.call_soon_threadsafe(_encolar, correo)
@@ -1,6 +1,6 @@
 from __future__ import annotations
 
-from fastapi import FastAPI
+from fastapi import FastAPI, Request, Response
 from fastapi.responses import ORJSONResponse
 from fastapi.middleware.cors import CORSMiddleware
 
@@ -19,6 +19,8 @@ from .routers import (
     dev as dev_router,
 )
 from .utils import backups
+from .utils.audit import start_audit_worker, stop_audit_worker
+from .emailer import start_email_worker, stop_email_worker
 
 app = FastAPI(
     title="Panel de Votaciones y Asistencia",
@@ -43,10 +45,28 @@ app.add_middleware(
     dev_mode=bool(getattr(settings, "dev_mode", False)),
 )
 
+# Los repos señalan datos inválidos con ValueError: 400 con el mensaje, en un
+# único sitio en lugar de un try/except por endpoint. Solo ValueError tal cual:
+# sus subclases (ValidationError de pydantic, JSONDecodeError, UnicodeError...)
+# son fallos internos y siguen siendo un 500 sin exponer su texto.
+@app.exception_handler(ValueError)
+async def _value_error_handler(request: Request, exc: ValueError):
+    if type(exc) is not ValueError:
+        raise exc
+    return ORJSONResponse({"detail": str(exc)}, status_code=400)
+
 @app.on_event("startup")
 async def _startup():
     # Programa backup diario si APScheduler está instalado (inofensivo si no)
     backups.start_scheduler()
+    await start_audit_worker()
+    await start_email_worker()
+
+@app.on_event("shutdown")
+async def _shutdown():
+    # Envía los correos y vuelca los eventos de auditoría pendientes
+    await stop_email_worker()
+    await stop_audit_worker()
 
 # Routers
 app.include_router(auth_router.router)
@@ -59,6 +79,9 @@ app.include_router(admin_solicitudes_router.router)
 app.include_router(solicitudes_router.router)
 app.include_router(dev_router.router)
 
+# Cuerpo constante: el healthcheck no serializa nada por petición
+_HEALTH_BODY = b'{"ok":true}'
+
 @app.get("/health")
-def health():
-    return {"ok": True}
+async def health():
+    return Response(content=_HEALTH_BODY, media_type="application/json")
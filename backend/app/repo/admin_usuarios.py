@@ -2,37 +2,28 @@ from __future__ import annotations
 import csv
 import io
 import os
+from itertools import islice
 from pathlib import Path
-from typing import Any, Dict, List, Optional
+from typing import Annotated, Any, Dict, Iterator, List, Optional, Set, Tuple
 
-from .base import ensure_dir, read_json, write_json
+from pydantic import EmailStr, StringConstraints, TypeAdapter, ValidationError
+from typing_extensions import TypedDict  # pydantic exige esta variante en < 3.12
+
+from . import usuarios as _usuarios
+from .base import Echo, ensure_dir, stat_key
+from .usuarios import (
+    INDEX_FILE,
+    _ajusta_activos,
+    _index_lock,
+    _index_snapshot,
+    _load_index,
+    _read_perfil,
+    _save_index,
+    _write_perfil,
+)
 from ..config import settings
 
 USERS_DIR = Path(settings.data_dir) / "usuarios"
-INDEX_FILE = USERS_DIR / "index.json"
-
-def _load_index() -> Dict[str, Any]:
-    ensure_dir(str(USERS_DIR))
-    idx = read_json(str(INDEX_FILE)) or {}
-    idx.setdefault("by_email", {})
-    idx.setdefault("by_niu", {})
-    idx.setdefault("permitidos", {})
-    return idx
-
-def _save_index(idx: Dict[str, Any]) -> None:
-    ensure_dir(str(USERS_DIR))
-    write_json(str(INDEX_FILE), idx)
-
-def _perfil_path(user_id: str) -> Path:
-    return USERS_DIR / user_id / "perfil.json"
-
-def _read_perfil(user_id: str) -> Dict[str, Any]:
-    return read_json(str(_perfil_path(user_id))) or {}
-
-def _write_perfil(user_id: str, perfil: Dict[str, Any]) -> None:
-    dirp = USERS_DIR / user_id
-    ensure_dir(str(dirp))
-    write_json(str(dirp / "perfil.json"), perfil)
 
 def _norm_email(email: str) -> str:
     return (email or "").strip().lower()
@@ -41,43 +32,102 @@ def _norm_niu(niu: str) -> str:
     return (niu or "").strip()
 
 # ----------------------- listar/filtrar -----------------------
-def listar(
-    query: Optional[str] = None,
-    grupo: Optional[str] = None,
-    curso: Optional[str] = None,
-    es_admin: Optional[bool] = None,
-    eliminado: Optional[bool] = None,
-) -> List[Dict[str, Any]]:
+# Listado en memoria para los filtros del panel: perfiles ordenados por nombre
+# y posiciones por grupo/curso. Se reconstruye si cambia el índice en disco o
+# si algún proceso ha escrito un perfil (usuarios.PERFILES_MARCA).
+_LISTADO_FIRMA: Optional[Tuple[Any, ...]] = None
+_LISTADO: List[Dict[str, Any]] = []
+_POR_GRUPO: Dict[str, Set[int]] = {}
+_POR_CURSO: Dict[str, Set[int]] = {}
+
+def _listado() -> List[Dict[str, Any]]:
+    global _LISTADO_FIRMA, _LISTADO, _POR_GRUPO, _POR_CURSO
+    firma = (_usuarios._PERFILES_GEN, stat_key(INDEX_FILE), _usuarios.perfiles_marca())
+    if firma == _LISTADO_FIRMA:
+        return _LISTADO
+
     ensure_dir(str(USERS_DIR))
-    out: List[Dict[str, Any]] = []
-    for name in os.listdir(USERS_DIR):
-        if name == "index.json":
-            continue
-        p = _read_perfil(name)
-        if not p:
-            continue
+    perfiles: List[Dict[str, Any]] = []
+    with os.scandir(USERS_DIR) as it:
+        for entry in it:
+            if not entry.is_dir():
+                continue
+            p = _read_perfil(entry.name)
+            if p:
+                perfiles.append(p)
+    perfiles.sort(key=lambda r: ((r.get("nombre") or "").lower(), r.get("niu") or ""))
+
+    por_grupo: Dict[str, Set[int]] = {}
+    por_curso: Dict[str, Set[int]] = {}
+    for i, p in enumerate(perfiles):
+        por_grupo.setdefault(p.get("grupo") or "", set()).add(i)
+        por_curso.setdefault(p.get("curso") or "", set()).add(i)
+
+    _LISTADO, _POR_GRUPO, _POR_CURSO = perfiles, por_grupo, por_curso
+    _LISTADO_FIRMA = firma
+    return perfiles
+
+def _filtrar(
+    query: Optional[str],
+    grupo: Optional[str],
+    curso: Optional[str],
+    es_admin: Optional[bool],
+    eliminado: Optional[bool],
+) -> List[Dict[str, Any]]:
+    perfiles = _listado()
+    # grupo/curso por índice; el resto se comprueba sobre los candidatos
+    candidatos: Optional[Set[int]] = None
+    if grupo is not None:
+        candidatos = _POR_GRUPO.get(grupo, set())
+    if curso is not None:
+        por_curso = _POR_CURSO.get(curso, set())
+        candidatos = por_curso if candidatos is None else candidatos & por_curso
+    orden = range(len(perfiles)) if candidatos is None else sorted(candidatos)
 
-        if query:
-            q = query.strip().lower()
+    q = query.strip().lower() if query else ""
+    out: List[Dict[str, Any]] = []
+    for i in orden:
+        p = perfiles[i]
+        if q:
             if q not in (p.get("nombre", "") or "").lower() \
                and q not in (p.get("email", "") or "").lower() \
                and q not in (p.get("niu", "") or "").lower():
                 continue
-        if grupo is not None and (p.get("grupo") or "") != grupo:
-            continue
-        if curso is not None and (p.get("curso") or "") != curso:
-            continue
         if es_admin is not None and bool(p.get("es_admin")) != bool(es_admin):
             continue
         if eliminado is not None and bool(p.get("eliminado", False)) != bool(eliminado):
             continue
-
         out.append(p)
-
-    out.sort(key=lambda r: ((r.get("nombre") or "").lower(), r.get("niu") or ""))
     return out
 
-# ----------------------- alta/edición/baja -----------------------
+def listar(
+    query: Optional[str] = None,
+    grupo: Optional[str] = None,
+    curso: Optional[str] = None,
+    es_admin: Optional[bool] = None,
+    eliminado: Optional[bool] = None,
+) -> List[Dict[str, Any]]:
+    return [dict(p) for p in _filtrar(query, grupo, curso, es_admin, eliminado)]
+
+def listar_pagina(
+    query: Optional[str] = None,
+    grupo: Optional[str] = None,
+    curso: Optional[str] = None,
+    es_admin: Optional[bool] = None,
+    eliminado: Optional[bool] = None,
+    limit: int = 100,
+    offset: int = 0,
+) -> Dict[str, Any]:
+    """Como listar(), pero solo materializa la página pedida."""
+    filtrados = _filtrar(query, grupo, curso, es_admin, eliminado)
+    total = len(filtrados)
+    fin = offset + limit
+    return {
+        "items": [dict(p) for p in filtrados[offset:fin]],
+        "total": total,
+        "next_offset": fin if fin < total else None,
+    }
+
 def alta_o_actualiza(
     email: str,
     niu: str,
@@ -87,12 +137,29 @@ def alta_o_actualiza(
     es_admin: Optional[bool] = None,
     marcar_permitido: bool = True,
 ) -> Dict[str, Any]:
+    with _index_lock():
+        idx = _load_index()
+        p = _alta_en_indice(idx, email, niu, nombre, grupo, curso, es_admin, marcar_permitido)
+        _save_index(idx)
+    return p
+
+def _alta_en_indice(
+    idx: Dict[str, Any],
+    email: str,
+    niu: str,
+    nombre: Optional[str],
+    grupo: Optional[str],
+    curso: Optional[str],
+    es_admin: Optional[bool],
+    marcar_permitido: bool,
+) -> Dict[str, Any]:
+    """Alta/actualización sobre un índice ya cargado; escribe el perfil pero
+    deja al llamador el guardado del índice (una sola vez por lote)."""
     email = _norm_email(email)
     niu = _norm_niu(niu)
     if not email or not niu:
         raise ValueError("email y niu son obligatorios")
 
-    idx = _load_index()
     by_email = idx["by_email"]
     by_niu = idx["by_niu"]
 
@@ -106,14 +173,15 @@ def alta_o_actualiza(
         by_email.pop(existing_email_from_niu, None)
 
     user_id = niu
+    p = _read_perfil(user_id)
     by_email[email] = user_id
     by_niu[niu] = email
     if marcar_permitido:
         idx["permitidos"][email] = True
-    _save_index(idx)
+    if not p:
+        _ajusta_activos(idx, +1)
 
     # perfil en carpeta
-    p = _read_perfil(user_id)
     p.setdefault("user_id", user_id)
     p["email"] = email
     p["niu"] = user_id
@@ -170,26 +238,30 @@ def baja_logica(user_id: str, undo: bool = False) -> Dict[str, Any]:
     p = _read_perfil(user_id)
     if not p:
         raise ValueError("Usuario no encontrado")
+    era_eliminado = bool(p.get("eliminado", False))
     p["eliminado"] = not bool(undo)
     _write_perfil(user_id, p)
 
     # desmarcar permitido si se da de baja
-    idx = _load_index()
-    email = p.get("email") or ""
-    if email:
-        idx["permitidos"][email] = False if not undo else True
+    with _index_lock():
+        idx = _load_index()
+        email = p.get("email") or ""
+        if email:
+            idx["permitidos"][email] = False if not undo else True
+        if era_eliminado != p["eliminado"]:
+            _ajusta_activos(idx, -1 if p["eliminado"] else +1)
         _save_index(idx)
     return p
 
 # ----------------------- export/import CSV -----------------------
-def export_csv() -> str:
-    rows = listar()
-    import io, csv
-    buf = io.StringIO()
-    w = csv.writer(buf)
-    w.writerow(["user_id", "niu", "email", "nombre", "grupo", "curso", "es_admin", "eliminado", "completo"])
-    for p in rows:
-        w.writerow([
+_CSV_CABECERA = ["user_id", "niu", "email", "nombre", "grupo", "curso", "es_admin", "eliminado", "completo"]
+
+def export_csv_iter() -> Iterator[str]:
+    """Genera el CSV de usuarios línea a línea (cabecera incluida)."""
+    w = csv.writer(Echo())
+    yield w.writerow(_CSV_CABECERA)
+    for p in listar():
+        yield w.writerow([
             p.get("user_id") or "",
             p.get("niu") or "",
             p.get("email") or "",
@@ -200,29 +272,70 @@ def export_csv() -> str:
             "1" if p.get("eliminado") else "0",
             "1" if p.get("completo") else "0",
         ])
-    return buf.getvalue()
+
+def export_csv() -> str:
+    return "".join(export_csv_iter())
+
+_IMPORT_LOTE = 500
+# Valores de la columna es_admin que cuentan como verdadero
+_VERDADEROS = frozenset(("1", "true", "yes", "si", "sí"))
+
+class _FilaCSV(TypedDict):
+    """Mismas reglas que el alta individual (AltaUsuarioIn)."""
+    email: EmailStr
+    niu: Annotated[str, StringConstraints(strip_whitespace=True, min_length=3, max_length=50)]
+    nombre: Annotated[str, StringConstraints(strip_whitespace=True, min_length=2, max_length=120)]
+    grupo: Optional[str]
+    curso: Optional[str]
+
+# Validador compilado una vez y reutilizado en cada fila
+_FILA_CSV = TypeAdapter(_FilaCSV)
+
+def _error_fila(e: ValidationError) -> str:
+    return "; ".join(f"{'.'.join(str(x) for x in err['loc'])}: {err['msg']}" for err in e.errors())
+
+def _importa_fila(idx: Dict[str, Any], row: Dict[str, Any]) -> None:
+    fila = _FILA_CSV.validate_python({
+        "email": row.get("email") or "",
+        "niu": row.get("niu") or "",
+        "nombre": row.get("nombre") or "",
+        "grupo": row.get("grupo"),
+        "curso": row.get("curso"),
+    })
+    es_admin = None
+    if "es_admin" in row and row.get("es_admin") not in (None, ""):
+        es_admin = str(row["es_admin"]).strip().lower() in _VERDADEROS
+    _alta_en_indice(
+        idx, fila["email"], fila["niu"], fila["nombre"], fila["grupo"], fila["curso"],
+        es_admin, marcar_permitido=True,
+    )
 
 def import_csv_text(csv_text: str) -> Dict[str, Any]:
-    import io, csv
-    f = io.StringIO(csv_text)
-    r = csv.DictReader(f)
+    """Importa usuarios desde CSV. El índice se carga y se guarda una vez
+    por cada lote de _IMPORT_LOTE filas, no por fila."""
+    r = csv.DictReader(io.StringIO(csv_text))
     req = {"email", "niu", "nombre"}
     if not req.issubset({(h or "").strip().lower() for h in r.fieldnames or []}):
         raise ValueError("Cabeceras requeridas: email, niu, nombre")
 
     ok, errors = 0, []
-    for i, row in enumerate(r, start=2):
-        try:
-            email = row.get("email") or ""
-            niu = row.get("niu") or ""
-            nombre = row.get("nombre") or ""
-            grupo = row.get("grupo")
-            curso = row.get("curso")
-            es_admin = None
-            if "es_admin" in row and row.get("es_admin") not in (None, ""):
-                es_admin = str(row["es_admin"]).strip().lower() in ("1", "true", "yes", "si", "sí")
-            alta_o_actualiza(email=email, niu=niu, nombre=nombre, grupo=grupo, curso=curso, es_admin=es_admin, marcar_permitido=True)
-            ok += 1
-        except Exception as e:
-            errors.append({"linea": i, "error": str(e)})
+    filas = enumerate(r, start=2)
+    while True:
+        lote = list(islice(filas, _IMPORT_LOTE))
+        if not lote:
+            break
+        # Un lote por ciclo leer-modificar-guardar bajo el lock del índice:
+        # las altas concurrentes (OTP, bajas...) no se pisan entre lotes
+        with _index_lock():
+            idx = _load_index()
+            antes = _index_snapshot(idx)
+            for i, row in lote:
+                try:
+                    _importa_fila(idx, row)
+                    ok += 1
+                except ValidationError as e:
+                    errors.append({"linea": i, "error": _error_fila(e)})
+                except Exception as e:
+                    errors.append({"linea": i, "error": str(e)})
+            _save_index(idx, antes)
     return {"importados": ok, "errores": errors}
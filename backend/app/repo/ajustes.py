@@ -1,10 +1,11 @@
 from __future__ import annotations
 
 import base64
+import os
 from pathlib import Path
-from typing import Any, Dict, List, Optional
+from typing import Any, BinaryIO, Dict, FrozenSet, Iterable, List, Optional, Tuple
 
-from .base import DATA_DIR, ensure_dir, read_json, write_json
+from .base import DATA_DIR, ensure_dir, read_json, stat_key, write_json
 
 # ============
 # Rutas / FS
@@ -21,23 +22,55 @@ F_NOTIFS          = AJ_DIR / "notificaciones.json"   # { "admin_emails": [...],
 F_GENERAL         = AJ_DIR / "general.json"          # ver get_general() abajo
 F_LOGO            = AJ_DIR / "logo.png"              # binario
 
+# JSON de ajustes ya parseado, validado por stat_key: cualquier escritura
+# (write_json reemplaza el fichero) o un cambio desde otro proceso lo invalida.
+_JSON_CACHE: Dict[Path, Tuple[Any, Any]] = {}
+
+def _read_cached(path: Path, default: Any) -> Any:
+    """Como read_json, sin releer ni parsear mientras el fichero no cambie.
+
+    El valor devuelto es compartido: los getters construyen su salida a partir
+    de él y nunca lo modifican.
+    """
+    key = stat_key(path)
+    if key is None:
+        return default
+    hit = _JSON_CACHE.get(path)
+    if hit is None or hit[0] != key:
+        hit = (key, read_json(path, default=default))
+        _JSON_CACHE[path] = hit
+    return hit[1]
+
 # ==============================
 # Dominios permitidos (login)
 # ==============================
+# (stat_key del fichero, lista ordenada, frozenset para pertenencia O(1))
+_DOMINIOS_CACHE: Optional[Tuple[Any, List[str], FrozenSet[str]]] = None
+
+def _norm_dominios(domains: Iterable[Any]) -> List[str]:
+    # strip también tras quitar la '@': "@ uab.cat" -> "uab.cat"; vacías fuera
+    limpios = (d.strip().lower().lstrip("@").strip() for d in domains if isinstance(d, str))
+    return sorted(dict.fromkeys(d for d in limpios if d))
+
+def _dominios() -> Tuple[List[str], FrozenSet[str]]:
+    global _DOMINIOS_CACHE
+    key = stat_key(F_DOMINIOS)
+    if _DOMINIOS_CACHE is None or _DOMINIOS_CACHE[0] != key:
+        data = read_json(F_DOMINIOS, default={"permitidos": []}) or {}
+        doms = _norm_dominios(data.get("permitidos", []))
+        _DOMINIOS_CACHE = (key, doms, frozenset(doms))
+    return _DOMINIOS_CACHE[1], _DOMINIOS_CACHE[2]
+
 def get_allowed_domains() -> List[str]:
-    data = read_json(F_DOMINIOS, default={"permitidos": []}) or {}
-    doms = []
-    for d in data.get("permitidos", []):
-        if isinstance(d, str) and d.strip():
-            doms.append(d.strip().lower().lstrip("@"))
-    return sorted(set(doms))
+    return list(_dominios()[0])
+
+def is_allowed_domain(domain: str) -> bool:
+    """True si el dominio está permitido (lista vacía = sin restricción)."""
+    permitidos = _dominios()[1]
+    return not permitidos or domain in permitidos
 
 def set_allowed_domains(domains: List[str]) -> List[str]:
-    clean = []
-    for d in (domains or []):
-        if isinstance(d, str) and d.strip():
-            clean.append(d.strip().lower().lstrip("@"))
-    clean = sorted(set(clean))
+    clean = _norm_dominios(domains or [])
     write_json(F_DOMINIOS, {"permitidos": clean})
     return list(clean)
 
@@ -55,6 +88,8 @@ def _smtp_defaults() -> Dict[str, Any]:
         "use_starttls": True,
     }
 
+_PROVEEDORES_OUTLOOK = frozenset(("outlook", "office365", "o365"))
+
 def _smtp_runtime_from(cfg: Dict[str, Any]) -> Dict[str, Any]:
     prov = (cfg.get("provider") or "gmail").lower()
     email = (cfg.get("email") or "").strip()
@@ -63,7 +98,7 @@ def _smtp_runtime_from(cfg: Dict[str, Any]) -> Dict[str, Any]:
 
     if prov == "gmail":
         host, port, use_starttls = "smtp.gmail.com", 587, True
-    elif prov in ("outlook", "office365", "o365"):
+    elif prov in _PROVEEDORES_OUTLOOK:
         host, port, use_starttls = "smtp.office365.com", 587, True
     else:
         host = (cfg.get("host") or "").strip()
@@ -83,7 +118,7 @@ def _smtp_runtime_from(cfg: Dict[str, Any]) -> Dict[str, Any]:
 
 def get_smtp_public() -> Dict[str, Any]:
     """Devuelve configuración SMTP sin exponer la contraseña."""
-    cfg = _smtp_defaults() | (read_json(F_SMTP, default={}) or {})
+    cfg = _smtp_defaults() | (_read_cached(F_SMTP, default={}) or {})
     run = _smtp_runtime_from(cfg)
     return {
         "provider": run["provider"],
@@ -97,11 +132,11 @@ def get_smtp_public() -> Dict[str, Any]:
 
 def get_smtp_runtime() -> Dict[str, Any]:
     """Devuelve configuración completa para enviar (incluye password)."""
-    cfg = _smtp_defaults() | (read_json(F_SMTP, default={}) or {})
+    cfg = _smtp_defaults() | (_read_cached(F_SMTP, default={}) or {})
     return _smtp_runtime_from(cfg)
 
 def set_smtp(input_cfg: Dict[str, Any]) -> Dict[str, Any]:
-    cur = _smtp_defaults() | (read_json(F_SMTP, default={}) or {})
+    cur = _smtp_defaults() | (_read_cached(F_SMTP, default={}) or {})
     # Campos admitidos
     for k in ("provider", "email", "from", "host", "port", "use_starttls"):
         if k in input_cfg:
@@ -115,8 +150,10 @@ def set_smtp(input_cfg: Dict[str, Any]) -> Dict[str, Any]:
 # ============
 # Theming
 # ============
+_THEMING_KEYS = frozenset(("primary", "secondary", "topbar", "accent"))
+
 def get_theming() -> Dict[str, str]:
-    data = read_json(
+    data = _read_cached(
         F_THEMING,
         default={"primary": "#0ea5e9", "secondary": "#64748b", "topbar": "#64748b", "accent": "#22c55e"},
     ) or {}
@@ -129,8 +166,8 @@ def get_theming() -> Dict[str, str]:
 
 def set_theming(colors: Dict[str, str]) -> Dict[str, str]:
     cur = get_theming()
-    for k in ("primary", "secondary", "topbar", "accent"):
-        v = colors.get(k)
+    for k in colors.keys() & _THEMING_KEYS:
+        v = colors[k]
         if isinstance(v, str) and v.strip():
             cur[k] = v.strip()
     write_json(F_THEMING, cur)
@@ -148,8 +185,10 @@ _DEF_REGLAS_ES: Dict[str, Dict[str, Any]] = {
     "es_admin": {"obligatorio": False, "edicion": "bloqueado",   "activo": True},
 }
 
+_EDICIONES = frozenset(("libre", "aprobacion", "bloqueado"))
+
 def get_perfil_reglas() -> Dict[str, Dict[str, Any]]:
-    data = read_json(F_PERFIL_REGLAS, default=_DEF_REGLAS_ES) or {}
+    data = _read_cached(F_PERFIL_REGLAS, default=_DEF_REGLAS_ES) or {}
     out: Dict[str, Dict[str, Any]] = {}
     for campo, conf in (data.items() if isinstance(data, dict) else []):
         if not isinstance(conf, dict):
@@ -157,7 +196,7 @@ def get_perfil_reglas() -> Dict[str, Dict[str, Any]]:
         ed = str(conf.get("edicion", "bloqueado")).lower()
         out[campo] = {
             "obligatorio": bool(conf.get("obligatorio", False)),
-            "edicion": ed if ed in ("libre", "aprobacion", "bloqueado") else "bloqueado",
+            "edicion": ed if ed in _EDICIONES else "bloqueado",
             "activo": bool(conf.get("activo", True)),
         }
     for k, v in _DEF_REGLAS_ES.items():
@@ -182,7 +221,7 @@ def set_perfil_reglas(reglas: Dict[str, Dict[str, Any]]) -> Dict[str, Dict[str,
 # Valores por defecto de perfil (UI)
 # ====================================
 def get_profile_defaults() -> Dict[str, Any]:
-    data = read_json(F_PERFIL_DEFAULTS, default={"grupo": None, "curso": None}) or {}
+    data = _read_cached(F_PERFIL_DEFAULTS, default={"grupo": None, "curso": None}) or {}
     return {"grupo": data.get("grupo"), "curso": data.get("curso")}
 
 def set_profile_defaults(values: Dict[str, Any]) -> Dict[str, Any]:
@@ -196,14 +235,14 @@ def set_profile_defaults(values: Dict[str, Any]) -> Dict[str, Any]:
 # Notificaciones
 # =================
 def get_notifications() -> Dict[str, Any]:
-    data = read_json(F_NOTIFS, default={"admin_emails": [], "recordatorios": {}}) or {}
+    data = _read_cached(F_NOTIFS, default={"admin_emails": [], "recordatorios": {}}) or {}
     admins = []
     for e in data.get("admin_emails", []) or []:
         if isinstance(e, str) and e.strip():
             admins.append(e.strip().lower())
     return {
         "admin_emails": sorted(list(set(admins))),
-        "recordatorios": data.get("recordatorios", {}) or {},
+        "recordatorios": dict(data.get("recordatorios", {}) or {}),
     }
 
 def set_notifications(cfg: Dict[str, Any]) -> Dict[str, Any]:
@@ -226,7 +265,7 @@ def get_admin_emails() -> List[str]:
 # General (TZ / OTP / Retención / Auto-export)
 # =======================
 def get_general() -> Dict[str, Any]:
-    data = read_json(
+    data = _read_cached(
         F_GENERAL,
         default={
             "timezone": "Europe/Madrid",
@@ -279,10 +318,30 @@ def set_general(cfg: Dict[str, Any]) -> Dict[str, Any]:
 # =========
 # Logo
 # =========
-def save_logo(content: bytes, suffix: str = ".png") -> Path:
+MAX_LOGO_BYTES = 2 * 1024 * 1024
+_LOGO_CHUNK = 64 * 1024
+
+def save_logo(src: BinaryIO, max_bytes: int = MAX_LOGO_BYTES) -> Path:
+    """Copia el logo desde un fichero abierto en bloques de 64 KiB.
+
+    Se escribe en un temporal del mismo directorio y se sustituye al final,
+    así un upload abortado no deja un logo a medias. Si supera ``max_bytes``
+    lanza ValueError.
+    """
     ensure_dir(AJ_DIR)
-    # siempre guardamos como .png por simplicidad (si quieres, cambia por suffix)
-    F_LOGO.write_bytes(content)
+    # siempre guardamos como .png por simplicidad
+    tmp = F_LOGO.with_suffix(F_LOGO.suffix + ".tmp")
+    total = 0
+    try:
+        with tmp.open("wb") as dst:
+            while chunk := src.read(_LOGO_CHUNK):
+                total += len(chunk)
+                if total > max_bytes:
+                    raise ValueError(f"El logo supera el máximo de {max_bytes // 1024} KiB")
+                dst.write(chunk)
+        os.replace(tmp, F_LOGO)
+    finally:
+        tmp.unlink(missing_ok=True)
     return F_LOGO
 
 def has_logo() -> bool:
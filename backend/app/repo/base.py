@@ -4,6 +4,7 @@ from pathlib import Path
 from typing import Any, Iterable, Iterator, Optional
 
 import json
+import os
 import orjson
 from filelock import FileLock
 
@@ -16,6 +17,18 @@ def ensure_dir(path: Path | str) -> None:
     p = Path(path)
     p.mkdir(parents=True, exist_ok=True)
 
+def stat_key(path: Path | str) -> Optional[tuple[int, int, int]]:
+    """(inode, tamaño, mtime_ns) de un fichero, o None si no existe.
+
+    Sirve para validar cachés en memoria: cualquier escritura (append o
+    reemplazo atómico, también desde otro proceso) cambia la clave.
+    """
+    try:
+        st = os.stat(path)
+    except (FileNotFoundError, NotADirectoryError):
+        return None
+    return st.st_ino, st.st_size, st.st_mtime_ns
+
 # ---------- JSON helpers (atómicos) ----------
 def _write_atomic(dst: Path, content: bytes) -> None:
     ensure_dir(dst.parent)
@@ -43,7 +56,7 @@ def write_json(path: Path | str, data: Any) -> None:
 # ---------- JSONL helpers ----------
 def append_jsonl(path: Path | str, record: Any) -> None:
     p = Path(path)
-    line = orjson.dumps(record) + b"\n"
+    line = orjson.dumps(record, option=orjson.OPT_APPEND_NEWLINE)
     lock_file = DATA_DIR / ".locks" / (p.name + ".lock")
     ensure_dir(p.parent)
     ensure_dir(lock_file.parent)
@@ -51,28 +64,74 @@ def append_jsonl(path: Path | str, record: Any) -> None:
         with p.open("ab") as fh:
             fh.write(line)
 
+def append_jsonl_many(path: Path | str, records: Iterable[Any]) -> None:
+    """Añade varias líneas con un único lock, write y fsync."""
+    p = Path(path)
+    buf = b"".join(orjson.dumps(r, option=orjson.OPT_APPEND_NEWLINE) for r in records)
+    if not buf:
+        return
+    lock_file = DATA_DIR / ".locks" / (p.name + ".lock")
+    ensure_dir(p.parent)
+    ensure_dir(lock_file.parent)
+    with FileLock(str(lock_file)):
+        with p.open("ab") as fh:
+            fh.write(buf)
+            fh.flush()
+            os.fsync(fh.fileno())
+
+def rewrite_jsonl(path: Path | str, rows: Iterable[Any]) -> None:
+    """Reescribe un JSONL completo de forma atómica.
+
+    El temporal vive en el mismo directorio (``os.replace`` nunca cae en una
+    copia entre sistemas de ficheros) y todo se escribe con un único write.
+    """
+    p = Path(path)
+    ensure_dir(p.parent)
+    buf = b"".join(orjson.dumps(r, option=orjson.OPT_APPEND_NEWLINE) for r in rows)
+    tmp = p.with_suffix(p.suffix + ".tmp")
+    with tmp.open("wb") as fh:
+        fh.write(buf)
+        fh.flush()
+        os.fsync(fh.fileno())
+    os.replace(tmp, p)
+
+def loads_jsonl_line(line: bytes) -> Iterator[Any]:
+    """Documentos JSON de una línea JSONL (ninguno si está en blanco).
+
+    Lanza ValueError (JSONDecodeError) si la línea no es JSON válido.
+    """
+    if not line.strip():
+        return
+    try:
+        yield orjson.loads(line)
+    except orjson.JSONDecodeError:
+        # Soporte para líneas con múltiples documentos JSON
+        text = line.decode("utf-8")
+        decoder = json.JSONDecoder()
+        idx = 0
+        length = len(text)
+        while idx < length:
+            # Saltar espacios en blanco
+            while idx < length and text[idx].isspace():
+                idx += 1
+            if idx >= length:
+                break
+            obj, end = decoder.raw_decode(text, idx)
+            yield obj
+            idx = end
+
 def read_jsonl(path: Path | str) -> Iterator[Any]:
     p = Path(path)
     if not p.exists():
         return iter(())
     with p.open("rb") as fh:
         for line in fh:
-            if not line.strip():
-                continue
-            try:
-                yield orjson.loads(line)
-            except orjson.JSONDecodeError:
-                # Soporte para líneas con múltiples documentos JSON
-                text = line.decode("utf-8")
-                decoder = json.JSONDecoder()
-                idx = 0
-                length = len(text)
-                while idx < length:
-                    # Saltar espacios en blanco
-                    while idx < length and text[idx].isspace():
-                        idx += 1
-                    if idx >= length:
-                        break
-                    obj, end = decoder.raw_decode(text, idx)
-                    yield obj
-                    idx = end
+            yield from loads_jsonl_line(line)
+
+# ---------- CSV helpers ----------
+class Echo:
+    """Pseudo-fichero para csv.writer: ``write`` devuelve la línea en vez de
+    guardarla, así ``writer.writerow(row)`` produce el str listo para enviar."""
+
+    def write(self, value: str) -> str:
+        return value
@@ -7,10 +7,11 @@ import json
 import re
 from pathlib import Path
 from datetime import datetime, timezone
-from typing import Dict, Any, List, Optional
+from typing import Dict, Any, Iterator, List, Optional
 
 from ..config import settings
-from . import usuarios as usuarios_repo
+from . import admin_usuarios as admin_usuarios_repo
+from .base import Echo
 
 DATA_DIR = Path(settings.data_dir)
 
@@ -28,32 +29,50 @@ def export_usuarios_csv_to_file() -> str:
     """
     Guarda CSV de usuarios en Datos/usuarios/export_usuarios_YYYYMMDD.csv
     """
-    csv_str = usuarios_repo.export_csv()  # ya existente
     today = datetime.now().strftime("%Y%m%d")
     out_dir = DATA_DIR / "usuarios"
     _ensure_dir(out_dir)
     out_path = out_dir / f"export_usuarios_{today}.csv"
-    out_path.write_text(csv_str, encoding="utf-8")
+    with out_path.open("w", encoding="utf-8", newline="") as fh:
+        fh.writelines(admin_usuarios_repo.export_csv_iter())
     return str(out_path)
 
 # ---------------- Asistencia ----------------
-def export_asistencia_csv(reunion_id: str) -> str:
-    """
-    Lee Datos/asistencia/{id}/reunion.json y asistentes.jsonl y genera:
-    Datos/asistencia/{YYYY}/{MM}/asistencia_{id}_{slug}.csv
-
-    Cabeceras (roadmap):
-      ID, Título, Inicio(UTC y Europe/Madrid), Cierre(UTC y Europe/Madrid), Duración,
-      NIU, Nombre, Email, Asistencia(Sí/No), Hora_de_union(Europe/Madrid)
-    """
-    base = DATA_DIR / "asistencia" / reunion_id
-    meta_file = base / "reunion.json"
-    asist_file = base / "asistentes.jsonl"
-
+_ASISTENCIA_CABECERA = [
+    "reunion_id", "titulo",
+    "inicio_utc_iso", "inicio_eu_madrid",
+    "fin_utc_iso", "fin_eu_madrid",
+    "duracion_seg",
+    "niu", "nombre", "email", "asistencia", "hora_union_eu_madrid",
+]
+
+def _iso_from_ts(ts: int, tz_name: str) -> str:
+    try:
+        from zoneinfo import ZoneInfo
+        dt = datetime.fromtimestamp(ts, tz=timezone.utc)
+        if tz_name == "UTC":
+            return dt.isoformat()
+        return dt.astimezone(ZoneInfo(tz_name)).isoformat()
+    except Exception:
+        return ""
+
+# Ids de actividad (token_hex): nunca separadores de ruta ni '..'
+_REUNION_ID_RE = re.compile(r"[A-Za-z0-9_-]+")
+
+def _leer_reunion(reunion_id: str) -> Dict[str, Any]:
+    if not _REUNION_ID_RE.fullmatch(reunion_id or ""):
+        raise ValueError("reunion_id inválido")
+    meta_file = DATA_DIR / "asistencia" / reunion_id / "reunion.json"
     if not meta_file.exists():
         raise FileNotFoundError(f"No existe {meta_file}")
-    meta = json.loads(meta_file.read_text(encoding="utf-8") or "{}")
-    titulo = str(meta.get("titulo") or meta.get("nombre") or f"reunion_{reunion_id}")
+    return json.loads(meta_file.read_text(encoding="utf-8") or "{}")
+
+def _titulo_reunion(meta: Dict[str, Any], reunion_id: str) -> str:
+    return str(meta.get("titulo") or meta.get("nombre") or f"reunion_{reunion_id}")
+
+def _asistencia_lineas(reunion_id: str, meta: Dict[str, Any]) -> Iterator[str]:
+    asist_file = DATA_DIR / "asistencia" / reunion_id / "asistentes.jsonl"
+    titulo = _titulo_reunion(meta, reunion_id)
     inicio_utc = int(meta.get("inicio_ts", 0) or meta.get("inicio_utc_ts", 0))
     fin_utc = int(meta.get("fin_ts", 0) or meta.get("cierre_utc_ts", 0))
     # Duración
@@ -75,52 +94,46 @@ def export_asistencia_csv(reunion_id: str) -> str:
                 if uid and ts and uid not in presentes:
                     presentes[uid] = ts
 
-    # Listado de usuarios para marcar ausentes también
-    usuarios = usuarios_repo.listar()  # devuelve lista de perfiles
-    rows_io = io.StringIO()
-    w = csv.writer(rows_io)
-    w.writerow([
-        "reunion_id", "titulo",
-        "inicio_utc_iso", "inicio_eu_madrid",
-        "fin_utc_iso", "fin_eu_madrid",
-        "duracion_seg",
-        "niu", "nombre", "email", "asistencia", "hora_union_eu_madrid",
-    ])
-
-    def iso_from_ts(ts: int, tz_name: str) -> str:
-        try:
-            from zoneinfo import ZoneInfo
-            dt = datetime.fromtimestamp(ts, tz=timezone.utc)
-            if tz_name == "UTC":
-                return dt.isoformat()
-            return dt.astimezone(ZoneInfo(tz_name)).isoformat()
-        except Exception:
-            return ""
+    w = csv.writer(Echo())
+    yield w.writerow(_ASISTENCIA_CABECERA)
+
+    # Columnas de reunión: iguales en todas las filas
+    cols_reunion = [
+        reunion_id, titulo,
+        _iso_from_ts(inicio_utc, "UTC"),
+        _iso_from_ts(inicio_utc, "Europe/Madrid"),
+        _iso_from_ts(fin_utc, "UTC"),
+        _iso_from_ts(fin_utc, "Europe/Madrid"),
+        str(dur_s),
+    ]
 
-    for p in usuarios:
+    # Listado de usuarios para marcar ausentes también
+    for p in admin_usuarios_repo.listar():
         uid = str(p.get("user_id") or "")
-        niu = p.get("niu") or ""
-        nombre = p.get("nombre") or ""
-        email = p.get("email") or ""
         ts_union = presentes.get(uid)
-        asistencia = "Sí" if ts_union else "No"
-        w.writerow([
-            reunion_id, titulo,
-            iso_from_ts(inicio_utc, "UTC"),
-            iso_from_ts(inicio_utc, "Europe/Madrid"),
-            iso_from_ts(fin_utc, "UTC"),
-            iso_from_ts(fin_utc, "Europe/Madrid"),
-            str(dur_s),
-            niu, nombre, email, asistencia,
-            iso_from_ts(ts_union, "Europe/Madrid") if ts_union else "",
+        yield w.writerow(cols_reunion + [
+            p.get("niu") or "",
+            p.get("nombre") or "",
+            p.get("email") or "",
+            "Sí" if ts_union else "No",
+            _iso_from_ts(ts_union, "Europe/Madrid") if ts_union else "",
         ])
 
+def export_asistencia_csv(reunion_id: str) -> str:
+    """
+    Lee Datos/asistencia/{id}/reunion.json y asistentes.jsonl y genera:
+    Datos/asistencia/{YYYY}/{MM}/asistencia_{id}_{slug}.csv
+    """
+    meta = _leer_reunion(reunion_id)
+    titulo = _titulo_reunion(meta, reunion_id)
+
     # Ruta de salida
     now = datetime.now()
     out_dir = DATA_DIR / "asistencia" / f"{now:%Y}" / f"{now:%m}"
     _ensure_dir(out_dir)
     out_path = out_dir / f"asistencia_{reunion_id}_{_slug(titulo)}.csv"
-    out_path.write_text(rows_io.getvalue(), encoding="utf-8")
+    with out_path.open("w", encoding="utf-8", newline="") as fh:
+        fh.writelines(_asistencia_lineas(reunion_id, meta))
     return str(out_path)
 
 # ---------------- Votaciones ----------------
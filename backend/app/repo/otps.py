@@ -7,7 +7,7 @@ from typing import Dict, Tuple
 
 from .base import read_json, write_json, ensure_dir, DATA_DIR
 from . import ajustes as ajustes_repo
-from ..emailer import send_email
+from ..emailer import enqueue_email
 
 AUTH_DIR = DATA_DIR / "auth"
 ensure_dir(AUTH_DIR)
@@ -40,11 +40,7 @@ def request(email: str) -> Tuple[bool, str]:
     _save(store)
 
     # Enviar email (no exponemos el código por API)
-    try:
-        import asyncio
-        asyncio.create_task(send_email(email, "Tu código de acceso", f"Tu código es: {code} (caduca en {ttl}s)"))
-    except Exception:
-        pass
+    enqueue_email([email], "Tu código de acceso", f"Tu código es: {code} (caduca en {ttl}s)")
 
     return True, "Código enviado por email."
 
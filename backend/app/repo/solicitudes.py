@@ -1,33 +1,17 @@
 from __future__ import annotations
-import time, secrets
 
-import json
-import os
 import secrets
-import tempfile
 import time
 from pathlib import Path
-from typing import Dict, Any
-from .base import append_jsonl, ensure_dir
 from typing import Any, Dict, List, Optional
 
-from .base import append_jsonl, ensure_dir, read_jsonl
+from .base import append_jsonl, ensure_dir, read_jsonl, rewrite_jsonl
 from ..config import settings
 
 SOL_DIR = Path(settings.data_dir) / "solicitudes"
 SOL_FILE = SOL_DIR / "solicitudes.jsonl"
 
 
-def _rewrite_jsonl(path: str, rows: List[Dict[str, Any]]) -> None:
-    """Reescribe un JSONL de forma atómica."""
-    ensure_dir(os.path.dirname(path))
-    with tempfile.NamedTemporaryFile("w", delete=False, encoding="utf-8") as tf:
-        for r in rows:
-            tf.write(json.dumps(r, ensure_ascii=False) + "\n")
-        tmp = tf.name
-    os.replace(tmp, path)
-
-
 def _leer() -> List[Dict[str, Any]]:
     return list(read_jsonl(str(SOL_FILE))) or []
 
@@ -98,7 +82,7 @@ def resolver(
             new_rows.append(r)
     if not found:
         raise ValueError("Solicitud no encontrada")
-    _rewrite_jsonl(str(SOL_FILE), new_rows)
+    rewrite_jsonl(str(SOL_FILE), new_rows)
     return found
 
 
@@ -3,14 +3,38 @@ from __future__ import annotations
 
 import os
 from pathlib import Path
-from typing import Any, Dict, Optional
+from typing import Any, Dict, Iterable, Optional, Tuple
 
-from .base import ensure_dir, read_json, write_json
+import orjson
+from filelock import FileLock
+
+from .base import ensure_dir, read_json, stat_key, write_json
 from ..config import settings  # <- FIX: sube un nivel
 
 # -------------------- Rutas / ficheros --------------------
 USERS_DIR = Path(settings.data_dir) / "usuarios"
 INDEX_FILE = USERS_DIR / "index.json"
+# Marca que cambia en cada escritura de perfil, desde cualquier proceso
+# (otro worker, scripts): valida cachés derivados de todos los perfiles.
+PERFILES_MARCA = USERS_DIR / ".perfiles_marca.json"
+
+# Perfiles ya parseados: user_id -> (stat_key, perfil). Se revalida con un
+# stat en cada lectura, así que no hace falta invalidar al escribir.
+_PERFIL_CACHE: Dict[str, Tuple[Tuple[int, int, int], Dict[str, Any]]] = {}
+
+# Contador de escrituras de perfil en este proceso: invalida índices derivados
+# (p. ej. el listado de admin_usuarios) sin tener que releer cada fichero.
+_PERFILES_GEN = 0
+
+# Lock del ciclo leer-modificar-guardar del índice, entre hilos y procesos:
+# sin él un _save_index pisa lo que otro escribió entre su lectura y su
+# escritura. FileLock es reentrante, así que las funciones pueden anidarse.
+_INDEX_LOCK_FILE = Path(settings.data_dir) / ".locks" / "usuarios_index.lock"
+_INDEX_LOCK = FileLock(str(_INDEX_LOCK_FILE))
+
+def _index_lock() -> FileLock:
+    ensure_dir(str(_INDEX_LOCK_FILE.parent))
+    return _INDEX_LOCK
 
 # -------------------- Utilidades de IO --------------------
 def _load_index() -> Dict[str, Any]:
@@ -20,22 +44,71 @@ def _load_index() -> Dict[str, Any]:
     idx.setdefault("by_email", {})
     idx.setdefault("by_niu", {})
     idx.setdefault("permitidos", {})
+    if "active_count" not in idx:
+        # Índices antiguos: se calcula una vez recorriendo carpetas y se persiste
+        with _index_lock():
+            idx["active_count"] = _cuenta_activos()
+            write_json(str(INDEX_FILE), idx)
     return idx
 
-def _save_index(idx: Dict[str, Any]) -> None:
+def _save_index(idx: Dict[str, Any], antes: Optional[bytes] = None) -> None:
+    """Guarda el índice. Si se pasa ``antes`` (snapshot de _index_snapshot)
+    y el contenido no ha cambiado, no se reescribe el fichero."""
+    if antes is not None and _index_snapshot(idx) == antes:
+        return
     ensure_dir(str(USERS_DIR))
     write_json(str(INDEX_FILE), idx)
 
+def _index_snapshot(idx: Dict[str, Any]) -> bytes:
+    return orjson.dumps(idx)
+
+def _ajusta_activos(idx: Dict[str, Any], delta: int) -> None:
+    """Mantiene ``active_count`` (usuarios no eliminados) dentro del índice."""
+    idx["active_count"] = max(0, int(idx.get("active_count", 0)) + delta)
+
+def _cuenta_activos() -> int:
+    """Recuento lento: lee todos los perfiles de USERS_DIR."""
+    n = 0
+    for name in os.listdir(USERS_DIR):
+        if name == "index.json":
+            continue
+        p = _read_perfil(name)
+        if p and not bool(p.get("eliminado", False)):
+            n += 1
+    return n
+
 def _perfil_path(user_id: str) -> Path:
     return USERS_DIR / user_id / "perfil.json"
 
 def _read_perfil(user_id: str) -> Dict[str, Any]:
-    return read_json(str(_perfil_path(user_id))) or {}
+    """Devuelve una copia del perfil (los llamadores pueden mutarla)."""
+    path = _perfil_path(user_id)
+    key = stat_key(path)
+    if key is None:
+        _PERFIL_CACHE.pop(user_id, None)
+        return {}
+    hit = _PERFIL_CACHE.get(user_id)
+    if hit is None or hit[0] != key:
+        hit = (key, read_json(str(path)) or {})
+        _PERFIL_CACHE[user_id] = hit
+    return dict(hit[1])
 
 def _write_perfil(user_id: str, perfil: Dict[str, Any]) -> None:
+    global _PERFILES_GEN
     d = USERS_DIR / user_id
     ensure_dir(str(d))
     write_json(str(d / "perfil.json"), perfil)
+    _PERFILES_GEN += 1
+    # Contenido aleatorio: a diferencia del mtime, no puede repetirse entre
+    # dos escrituras seguidas
+    write_json(str(PERFILES_MARCA), os.urandom(8).hex())
+
+def perfiles_marca() -> bytes:
+    """Contenido actual de la marca de escrituras de perfil (b"" si no hay)."""
+    try:
+        return PERFILES_MARCA.read_bytes()
+    except FileNotFoundError:
+        return b""
 
 def _norm_email(email: str) -> str:
     return (email or "").strip().lower()
@@ -50,7 +123,13 @@ def _recalcula_completitud(p: Dict[str, Any]) -> bool:
 
 # -------------------- Lectura / existencia --------------------
 def has_any_user(include_eliminados: bool = False) -> bool:
-    """Devuelve True si existe al menos un usuario (según perfiles en carpeta)."""
+    """Devuelve True si existe al menos un usuario.
+
+    Sin eliminados basta con el contador del índice; con eliminados se
+    recorren los perfiles en carpeta.
+    """
+    if not include_eliminados:
+        return int(_load_index().get("active_count", 0)) > 0
     ensure_dir(str(USERS_DIR))
     for name in os.listdir(USERS_DIR):
         if name == "index.json":
@@ -67,13 +146,16 @@ def get_user_id_by_email(email: str) -> Optional[str]:
     idx = _load_index()
     return idx.get("by_email", {}).get(email)
 
-def user_exists_by_email(email: str) -> bool:
-    email = _norm_email(email)
+def get_active_user_id_by_email(email: str) -> Optional[str]:
+    """user_id del email si el usuario existe y no está eliminado; si no, None."""
     uid = get_user_id_by_email(email)
     if not uid:
-        return False
+        return None
     p = _read_perfil(uid)
-    return bool(p) and not bool(p.get("eliminado", False))
+    return uid if p and not p.get("eliminado", False) else None
+
+def user_exists_by_email(email: str) -> bool:
+    return get_active_user_id_by_email(email) is not None
 
 def user_exists(user_id: str) -> bool:
     user_id = _norm_niu(user_id)
@@ -99,6 +181,18 @@ def get_perfil(user_id: str) -> Dict[str, Any]:
 # Alias usado por algún router
 get_profile = get_perfil
 
+def get_perfiles_many(user_ids: Iterable[str]) -> Dict[str, Dict[str, Any]]:
+    """Perfiles de varios usuarios de una vez (user_id -> perfil).
+
+    Los ids repetidos se leen una sola vez y los inexistentes se omiten.
+    """
+    out: Dict[str, Dict[str, Any]] = {}
+    for uid in set(user_ids):
+        p = get_perfil(uid)
+        if p:
+            out[uid] = p
+    return out
+
 # -------------------- Escritura / coherencia --------------------
 def ensure_profile_links_if_exists(user_id: str, email: str) -> None:
     """
@@ -112,6 +206,7 @@ def ensure_profile_links_if_exists(user_id: str, email: str) -> None:
     if not p:
         # no hacemos nada si no existe el perfil (esto es deliberado)
         return
+    antes = dict(p)
 
     # completa campos mínimos
     p.setdefault("user_id", user_id)
@@ -125,17 +220,20 @@ def ensure_profile_links_if_exists(user_id: str, email: str) -> None:
     p.setdefault("eliminado", bool(p.get("eliminado", False)))
 
     _recalcula_completitud(p)
-    _write_perfil(user_id, p)
+    if p != antes:
+        _write_perfil(user_id, p)
 
     # índices
-    idx = _load_index()
-    by_email = idx["by_email"]
-    by_niu = idx["by_niu"]
-    if email:
-        by_email[email] = user_id
-        idx["permitidos"].setdefault(email, True)
-    by_niu[user_id] = p.get("email", email) or ""
-    _save_index(idx)
+    with _index_lock():
+        idx = _load_index()
+        idx_antes = _index_snapshot(idx)
+        by_email = idx["by_email"]
+        by_niu = idx["by_niu"]
+        if email:
+            by_email[email] = user_id
+            idx["permitidos"].setdefault(email, True)
+        by_niu[user_id] = p.get("email", email) or ""
+        _save_index(idx, idx_antes)
 
 def ensure_profile_links(user_id: str, email: str) -> None:
     """
@@ -145,6 +243,8 @@ def ensure_profile_links(user_id: str, email: str) -> None:
     email = _norm_email(email)
 
     p = _read_perfil(user_id) or {}
+    antes = dict(p)
+    nuevo = not p
     p.setdefault("user_id", user_id)
     p.setdefault("email", email)
     p.setdefault("niu", user_id)
@@ -155,35 +255,51 @@ def ensure_profile_links(user_id: str, email: str) -> None:
     p.setdefault("eliminado", False)
 
     _recalcula_completitud(p)
-    _write_perfil(user_id, p)
+    if p != antes:
+        _write_perfil(user_id, p)
 
-    idx = _load_index()
-    idx["by_email"][p["email"]] = user_id
-    idx["by_niu"][user_id] = p["email"]
-    idx["permitidos"].setdefault(p["email"], True)
-    _save_index(idx)
+    with _index_lock():
+        idx = _load_index()
+        idx_antes = _index_snapshot(idx)
+        idx["by_email"][p["email"]] = user_id
+        idx["by_niu"][user_id] = p["email"]
+        idx["permitidos"].setdefault(p["email"], True)
+        if nuevo:
+            _ajusta_activos(idx, +1)
+        _save_index(idx, idx_antes)
 
 def update_perfil_fields(user_id: str, nuevos_campos: Dict[str, Any]) -> Dict[str, Any]:
     """
     Mezcla y guarda cambios en el perfil (sin validar reglas de negocio aquí).
     """
     user_id = _norm_niu(user_id)
-    p = _read_perfil(user_id) or {}
-    p.update(nuevos_campos or {})
-    p.setdefault("user_id", user_id)
-    p.setdefault("niu", user_id)
-    p.setdefault("email", p.get("email") or "")
-    p.setdefault("eliminado", False)
-    _recalcula_completitud(p)
-    _write_perfil(user_id, p)
-
-    # mantener índices coherentes si cambió email
-    idx = _load_index()
-    if p.get("email"):
-        idx["by_email"][p["email"]] = user_id
-        idx["by_niu"][user_id] = p["email"]
-        idx["permitidos"].setdefault(p["email"], True)
-        _save_index(idx)
+    with _index_lock():
+        # El índice se carga antes de escribir el perfil: si hubiera que
+        # calcular active_count desde las carpetas, no incluiría este perfil
+        idx = _load_index()
+        idx_antes = _index_snapshot(idx)
+
+        p = _read_perfil(user_id) or {}
+        antes = dict(p)
+        p.update(nuevos_campos or {})
+        p.setdefault("user_id", user_id)
+        p.setdefault("niu", user_id)
+        p.setdefault("email", p.get("email") or "")
+        p.setdefault("eliminado", False)
+        _recalcula_completitud(p)
+        if p != antes:
+            _write_perfil(user_id, p)
+
+        # Si no había perfil se acaba de crear: cuenta como activo, como en
+        # las demás altas
+        if not antes and not bool(p.get("eliminado", False)):
+            _ajusta_activos(idx, +1)
+        # mantener índices coherentes si cambió email
+        if p.get("email"):
+            idx["by_email"][p["email"]] = user_id
+            idx["by_niu"][user_id] = p["email"]
+            idx["permitidos"].setdefault(p["email"], True)
+        _save_index(idx, idx_antes)
 
     return p
 
@@ -203,9 +319,11 @@ def set_niu_if_unique(user_id: str, nuevo_niu: str) -> bool:
         return False
 
     p = _read_perfil(user_id) or {}
+    antes = dict(p)
     p["niu"] = user_id
     _recalcula_completitud(p)
-    _write_perfil(user_id, p)
+    if p != antes:
+        _write_perfil(user_id, p)
     return True
 
 # -------------------- Bootstrap / creación --------------------
@@ -236,11 +354,13 @@ def bootstrap_first_admin_from_email(email: str) -> str:
     _recalcula_completitud(p)
     _write_perfil(user_id, p)
 
-    idx = _load_index()
-    idx["by_email"][email] = user_id
-    idx["by_niu"][user_id] = email
-    idx["permitidos"][email] = True
-    _save_index(idx)
+    with _index_lock():
+        idx = _load_index()
+        idx["by_email"][email] = user_id
+        idx["by_niu"][user_id] = email
+        idx["permitidos"][email] = True
+        _ajusta_activos(idx, +1)
+        _save_index(idx)
     return user_id
 
 def get_or_create_user_by_email(email: str) -> str:
@@ -249,34 +369,42 @@ def get_or_create_user_by_email(email: str) -> str:
     Solo usado en endpoints de dev/repair.
     """
     email = _norm_email(email)
-    idx = _load_index()
-    uid = idx["by_email"].get(email)
-    if uid:
-        return uid
-
-    # derivamos user_id de la parte local del email
-    if "@" not in email:
-        raise ValueError("Email inválido")
-    uid = _norm_niu(email.split("@", 1)[0])
-
-    # crea perfil mínimo
-    p = {
-        "user_id": uid,
-        "email": email,
-        "niu": uid,
-        "nombre": "",
-        "grupo": None,
-        "curso": None,
-        "es_admin": False,
-        "eliminado": False,
-    }
-    _recalcula_completitud(p)
-    _write_perfil(uid, p)
+    with _index_lock():
+        idx = _load_index()
+        uid = idx["by_email"].get(email)
+        if uid:
+            return uid
+
+        # derivamos user_id de la parte local del email
+        if "@" not in email:
+            raise ValueError("Email inválido")
+        uid = _norm_niu(email.split("@", 1)[0])
+        # La carpeta del NIU puede existir ya (p. ej. con otro email): solo
+        # suma un activo si no había perfil, como _alta_en_indice, o si el
+        # que había estaba eliminado (el perfil mínimo lo reactiva)
+        previo = _read_perfil(uid)
+        nuevo = not previo or bool(previo.get("eliminado", False))
+
+        # crea perfil mínimo
+        p = {
+            "user_id": uid,
+            "email": email,
+            "niu": uid,
+            "nombre": "",
+            "grupo": None,
+            "curso": None,
+            "es_admin": False,
+            "eliminado": False,
+        }
+        _recalcula_completitud(p)
+        _write_perfil(uid, p)
 
-    # índices
-    idx["by_email"][email] = uid
-    idx["by_niu"][uid] = email
-    idx["permitidos"].setdefault(email, True)
-    _save_index(idx)
+        # índices
+        idx["by_email"][email] = uid
+        idx["by_niu"][uid] = email
+        idx["permitidos"].setdefault(email, True)
+        if nuevo:
+            _ajusta_activos(idx, +1)
+        _save_index(idx)
 
-    return uid
+        return uid
@@ -1,16 +1,15 @@
 from __future__ import annotations
-import os
-import json
 import time
 import secrets
-import tempfile
 from datetime import datetime
 from pathlib import Path
 from typing import Dict, Any, List, Optional, Tuple
 
+import orjson
 from dateutil import parser, tz
+from filelock import FileLock
 
-from .base import ensure_dir, append_jsonl, read_jsonl
+from .base import DATA_DIR, ensure_dir, append_jsonl, loads_jsonl_line, read_jsonl, rewrite_jsonl, stat_key
 from ..config import settings
 
 # -------------------- Rutas --------------------
@@ -18,6 +17,28 @@ VOT_DIR = Path(settings.data_dir) / "votaciones"
 VOT_FILE = VOT_DIR / "votaciones.jsonl"
 VOTOS_FILE = VOT_DIR / "votos.jsonl"
 
+# Campos que se exponen en los listados (coinciden con VotacionOut)
+_CAMPOS_PUBLICOS = (
+    "id", "titulo", "descripcion", "opciones",
+    "inicio_iso", "fin_iso", "inicio_ts", "fin_ts",
+    "permitir_cambiar", "permite_fuera_de_hora", "secreto", "quorum_minimo",
+    "respuesta_abierta", "respuesta_abierta_etiqueta", "estado",
+)
+
+# -------------------- Caché en memoria --------------------
+# VOT_FILE es un log: cada edición se añade como registro completo con un
+# ``rev`` mayor y al leer se conserva la última revisión de cada id.
+# Votaciones indexadas por id + su JSON público ya serializado. La caché se
+# valida contra (inode, tamaño, mtime) de VOT_FILE: si el fichero solo ha
+# crecido se leen únicamente las líneas nuevas (y solo se invalida el JSON
+# de los ids afectados); si no, se recarga entero.
+_VOTS_STAT: Optional[Tuple[int, int, int]] = None
+# Bytes de VOT_FILE ya incorporados (hasta el último '\n' leído); puede ser
+# menor que el tamaño de _VOTS_STAT si la última línea estaba a medias.
+_VOTS_OFFSET = 0
+_VOTS_BY_ID: Dict[str, Dict[str, Any]] = {}
+_VOTS_JSON_BY_ID: Dict[str, bytes] = {}
+
 
 # -------------------- Util tiempo/IO --------------------
 def _tz():
@@ -42,18 +63,66 @@ def _to_ts(local_iso: str) -> Tuple[str, int]:
         dt = dt.astimezone(_tz())
     return dt.isoformat(timespec="minutes"), int(dt.timestamp())
 
-def _rewrite_jsonl(path: str, rows: List[Dict[str, Any]]) -> None:
-    ensure_dir(os.path.dirname(path))
-    with tempfile.NamedTemporaryFile("w", delete=False, encoding="utf-8") as tf:
-        for r in rows:
-            tf.write(json.dumps(r, ensure_ascii=False) + "\n")
-        tmp = tf.name
-    os.replace(tmp, path)
+
+def _plegar(v: Dict[str, Any]) -> None:
+    """Incorpora un registro a la caché si es la revisión más reciente."""
+    vid = v.get("id")
+    if not vid:
+        return
+    cur = _VOTS_BY_ID.get(vid)
+    if cur is None or int(v.get("rev", 0)) >= int(cur.get("rev", 0)):
+        _VOTS_BY_ID[vid] = v
+        _VOTS_JSON_BY_ID.pop(vid, None)
+
+
+def _plegar_desde(offset: int) -> int:
+    """Incorpora las líneas completas de VOT_FILE a partir de ``offset``.
+
+    Una última línea sin '\n' puede estar a medio escribir: se deja para la
+    siguiente lectura. Devuelve los bytes consumidos.
+    """
+    with open(VOT_FILE, "rb") as fh:
+        fh.seek(offset)
+        data = fh.read()
+    fin = data.rfind(b"\n") + 1
+    for line in data[:fin].splitlines():
+        for v in loads_jsonl_line(line):
+            _plegar(v)
+    return fin
+
+
+def _cargar_cache() -> Dict[str, Dict[str, Any]]:
+    """Devuelve {id: votación}. Los dicts son compartidos: no mutarlos."""
+    global _VOTS_STAT, _VOTS_OFFSET
+    key = stat_key(VOT_FILE)
+    if key is not None and key == _VOTS_STAT:
+        return _VOTS_BY_ID
+    prev = _VOTS_STAT
+    if key is None:
+        _VOTS_BY_ID.clear()
+        _VOTS_JSON_BY_ID.clear()
+        _VOTS_OFFSET = 0
+    else:
+        # Mismo fichero y sin truncar: solo hay líneas añadidas tras el offset
+        incremental = prev is not None and key[0] == prev[0] and key[1] >= _VOTS_OFFSET
+        if incremental:
+            try:
+                _VOTS_OFFSET += _plegar_desde(_VOTS_OFFSET)
+            except ValueError:
+                # Lo añadido no se puede leer desde el offset: se recarga entero
+                incremental = False
+        if not incremental:
+            _VOTS_BY_ID.clear()
+            _VOTS_JSON_BY_ID.clear()
+            _VOTS_OFFSET = _plegar_desde(0)
+    _VOTS_STAT = key
+    return _VOTS_BY_ID
 
 
 # -------------------- Core helpers --------------------
 def _leer_votaciones() -> List[Dict[str, Any]]:
-    return list(read_jsonl(str(VOT_FILE))) or []
+    """Última revisión de cada votación, en orden de creación."""
+    return list(_cargar_cache().values())
 
 def _leer_votos() -> List[Dict[str, Any]]:
     return list(read_jsonl(str(VOTOS_FILE))) or []
@@ -87,15 +156,24 @@ def _en_ventana(v: Dict[str, Any], ts: int) -> bool:
     return int(v["inicio_ts"]) <= ts <= int(v["fin_ts"])
 
 def get_votacion(votacion_id: str) -> Optional[Dict[str, Any]]:
-    for v in _leer_votaciones():
-        if v.get("id") == votacion_id:
-            return v
-    return None
+    return _cargar_cache().get(votacion_id)
 
 def listar_vigentes() -> List[Dict[str, Any]]:
-    alls = [v for v in _leer_votaciones() if v.get("estado") != "eliminada"]
+    alls = [v for v in _cargar_cache().values() if v.get("estado") != "eliminada"]
     return sorted(alls, key=lambda r: r.get("inicio_ts", 0))
 
+def votacion_json(v: Dict[str, Any]) -> bytes:
+    """Votación serializada con solo los campos públicos (memoizada por id)."""
+    b = _VOTS_JSON_BY_ID.get(v["id"])
+    if b is None:
+        b = orjson.dumps({k: v.get(k) for k in _CAMPOS_PUBLICOS})
+        _VOTS_JSON_BY_ID[v["id"]] = b
+    return b
+
+def listar_vigentes_json() -> bytes:
+    """Igual que listar_vigentes() pero ya serializado (solo campos públicos)."""
+    return b"[" + b",".join(votacion_json(v) for v in listar_vigentes()) + b"]"
+
 
 # -------------------- CRUD votaciones --------------------
 def crear_votacion(
@@ -142,13 +220,15 @@ def crear_votacion(
         "creado_en": time.time(),
     }
     append_jsonl(str(VOT_FILE), rec)
+    _plegar(rec)
     return rec
 
 def editar_votacion(votacion_id: str, cambios: dict) -> Dict[str, Any]:
-    rows = _leer_votaciones()
-    target = next((x for x in rows if x.get("id") == votacion_id), None)
-    if not target:
+    actual = get_votacion(votacion_id)
+    if not actual:
         raise ValueError("Votación no encontrada")
+    # copia: la caché no se toca hasta que la nueva revisión esté en disco
+    target = dict(actual)
 
     # Cerrar ahora
     if cambios.get("cerrar_ahora"):
@@ -228,9 +308,30 @@ def editar_votacion(votacion_id: str, cambios: dict) -> Dict[str, Any]:
     if int(target["fin_ts"]) <= int(target["inicio_ts"]):
         raise ValueError("La hora de fin debe ser posterior al inicio")
 
-    _rewrite_jsonl(str(VOT_FILE), rows)
+    # Se añade la nueva revisión completa al log (O(1), sin reescribir)
+    target["rev"] = int(target.get("rev", 0)) + 1
+    append_jsonl(str(VOT_FILE), target)
+    # ya en disco: entra en la caché y descarta su JSON memoizado
+    _plegar(target)
     return target
 
+def compactar_votaciones() -> int:
+    """Reescribe VOT_FILE dejando solo la última revisión de cada votación.
+
+    Se ejecuta periódicamente desde el scheduler. Devuelve nº de registros.
+    """
+    if not VOT_FILE.exists():
+        return 0
+    lock_file = DATA_DIR / ".locks" / (VOT_FILE.name + ".lock")
+    ensure_dir(lock_file.parent)
+    # mismo lock que append_jsonl: no se pierden altas/ediciones concurrentes
+    with FileLock(str(lock_file)):
+        rows = _leer_votaciones()
+        if sum(1 for _ in read_jsonl(str(VOT_FILE))) == len(rows):
+            return len(rows)
+        rewrite_jsonl(str(VOT_FILE), rows)
+    return len(rows)
+
 
 # -------------------- Votos --------------------
 def _ultimo_voto_por_usuario(votacion_id: str) -> Dict[str, Dict[str, Any]]:
@@ -9,72 +9,60 @@ accidentalmente.
 
 from __future__ import annotations
 
-from typing import Optional
+from typing import Literal, Optional
 
-from fastapi import APIRouter, Depends, HTTPException
+from fastapi import APIRouter, Depends
 from pydantic import BaseModel
 
-from ..deps.auth import get_current_user, UserCtx
+from ..deps.auth import require_admin, UserCtx
 from ..repo import solicitudes as repo
-from ..repo import usuarios as usuarios_repo
 from ..repo import admin_usuarios as admin_repo
 
 router = APIRouter(prefix="/admin/solicitudes", tags=["admin:solicitudes"])
 
 
-def _require_admin(user: UserCtx):
-    perfil = usuarios_repo.get_perfil(user.user_id)
-    if not bool(perfil.get("es_admin")):
-        raise HTTPException(status_code=403, detail="Solo administradores")
-
-
 @router.get("")
 async def listar(
     estado: Optional[str] = None,
     tipo: Optional[str] = None,
-    user: UserCtx = Depends(get_current_user),
+    user: UserCtx = Depends(require_admin),
 ):
-    _require_admin(user)
     return {"items": repo.listar(estado=estado, tipo=tipo)}
 
 
 class ResolverIn(BaseModel):
-    estado: str
+    estado: Literal["aceptada", "denegada"]
     comentario: Optional[str] = None
 
 
 @router.post("/{sol_id}/resolver")
-async def resolver(sol_id: str, body: ResolverIn, user: UserCtx = Depends(get_current_user)):
-    _require_admin(user)
-    try:
-        rec = repo.resolver(
-            sol_id.strip(),
-            estado=body.estado,
-            admin_id=user.user_id,
-            comentario=body.comentario,
+async def resolver(sol_id: str, body: ResolverIn, user: UserCtx = Depends(require_admin)):
+    rec = repo.resolver(
+        sol_id.strip(),
+        estado=body.estado,
+        admin_id=user.user_id,
+        comentario=body.comentario,
+    )
+
+    # Si la solicitud de ALTA es aceptada, crea el usuario correspondiente
+    if rec.get("estado") == "aceptada" and rec.get("tipo") == "alta":
+        payload = rec.get("payload") or {}
+        email = (payload.get("email") or "").strip().lower()
+        if not email:
+            raise ValueError("Solicitud de alta sin email")
+        niu = (payload.get("niu") or "").strip()
+        if not niu:
+            if "@" in email:
+                niu = email.split("@", 1)[0]
+            else:
+                raise ValueError("Solicitud de alta sin NIU válido")
+        nombre = (payload.get("nombre") or "").strip() or None
+        # Crea el usuario marcándolo como permitido
+        admin_repo.alta_o_actualiza(
+            email=email,
+            niu=niu,
+            nombre=nombre,
+            marcar_permitido=True,
         )
 
-        # Si la solicitud de ALTA es aceptada, crea el usuario correspondiente
-        if rec.get("estado") == "aceptada" and rec.get("tipo") == "alta":
-            payload = rec.get("payload") or {}
-            email = (payload.get("email") or "").strip().lower()
-            if not email:
-                raise ValueError("Solicitud de alta sin email")
-            niu = (payload.get("niu") or "").strip()
-            if not niu:
-                if "@" in email:
-                    niu = email.split("@", 1)[0]
-                else:
-                    raise ValueError("Solicitud de alta sin NIU válido")
-            nombre = (payload.get("nombre") or "").strip() or None
-            # Crea el usuario marcándolo como permitido
-            admin_repo.alta_o_actualiza(
-                email=email,
-                niu=niu,
-                nombre=nombre,
-                marcar_permitido=True,
-            )
-
-        return {"ok": True, "solicitud": rec}
-    except ValueError as e:
-        raise HTTPException(status_code=400, detail=str(e))
\ No newline at end of file
+    return {"ok": True, "solicitud": rec}
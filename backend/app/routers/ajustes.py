@@ -3,12 +3,14 @@ from __future__ import annotations
 from typing import List, Optional, Dict, Any, Literal
 
 from fastapi import APIRouter, Depends, UploadFile, File, HTTPException, Request
-from fastapi.responses import FileResponse
 from pydantic import BaseModel, Field, EmailStr, RootModel, ConfigDict
+from starlette.concurrency import run_in_threadpool
 
 from ..deps.auth import require_admin, UserCtx
+from ..deps.etag import etag_response, file_response
 from ..repo import ajustes as ajustes_repo
 from ..utils.audit import audit_event
+from ..utils.patch import patch_dict
 
 router = APIRouter(prefix="/ajustes", tags=["ajustes"])
 
@@ -57,6 +59,10 @@ class PerfilReglasIn(RootModel[Dict[str, Dict[str, Any]]]):
 class PerfilReglasOut(BaseModel):
     reglas: Dict[str, Dict[str, Any]]
 
+# Claves aceptadas por cada PATCH (constantes: se calculan una vez)
+_NOTIFICATIONS_KEYS = frozenset(("admin_emails", "recordatorios"))
+_GENERAL_KEYS = frozenset(("timezone", "otp", "retention", "auto_export"))
+
 class ThemingIn(BaseModel):
     primary: Optional[str] = None
     secondary: Optional[str] = None
@@ -77,20 +83,12 @@ class GeneralIn(BaseModel):
 # Dominios
 # ---------------------------
 @router.get("/domains", response_model=DomainsOut)
-def get_allowed_domains():
-    doms = ajustes_repo.get_allowed_domains()
-    return DomainsOut(allowed_domains=doms or [])
+def get_allowed_domains(request: Request):
+    return etag_response(request, {"allowed_domains": ajustes_repo.get_allowed_domains()})
 
 @router.put("/domains", response_model=DomainsOut)
 def set_allowed_domains(body: DomainsIn, user: UserCtx = Depends(require_admin), request: Request = None):
-    clean: List[str] = []
-    for d in body.allowed_domains:
-        d = (d or "").strip().lower()
-        if d.startswith("@"):
-            d = d[1:]
-        if d:
-            clean.append(d)
-    out = ajustes_repo.set_allowed_domains(clean)
+    out = ajustes_repo.set_allowed_domains(body.allowed_domains)
     audit_event(
         "ajustes_domains_update",
         actor_user_id=user.user_id,
@@ -154,9 +152,8 @@ async def smtp_test(to: EmailStr, user: UserCtx = Depends(require_admin), reques
 # Perfil: defaults y reglas
 # ---------------------------
 @router.get("/perfil/defaults", response_model=PerfilDefaultsOut)
-def get_perfil_defaults():
-    data = ajustes_repo.get_profile_defaults() or {}
-    return PerfilDefaultsOut(defaults=data)
+def get_perfil_defaults(request: Request):
+    return etag_response(request, {"defaults": ajustes_repo.get_profile_defaults() or {}})
 
 @router.patch("/perfil/defaults", response_model=PerfilDefaultsOut)
 def patch_perfil_defaults(body: PerfilDefaultsIn, user: UserCtx = Depends(require_admin), request: Request = None):
@@ -170,8 +167,8 @@ def patch_perfil_defaults(body: PerfilDefaultsIn, user: UserCtx = Depends(requir
     return PerfilDefaultsOut(defaults=out)
 
 @router.get("/perfil/reglas", response_model=PerfilReglasOut)
-def get_perfil_reglas():
-    return PerfilReglasOut(reglas=ajustes_repo.get_perfil_reglas())
+def get_perfil_reglas(request: Request):
+    return etag_response(request, {"reglas": ajustes_repo.get_perfil_reglas()})
 
 @router.put("/perfil/reglas", response_model=PerfilReglasOut)
 def put_perfil_reglas(body: PerfilReglasIn, user: UserCtx = Depends(require_admin), request: Request = None):
@@ -183,17 +180,12 @@ def put_perfil_reglas(body: PerfilReglasIn, user: UserCtx = Depends(require_admi
 # Theming
 # ---------------------------
 @router.get("/theming")
-def get_theming():
-    return ajustes_repo.get_theming()
+def get_theming(request: Request):
+    return etag_response(request, ajustes_repo.get_theming())
 
 @router.patch("/theming")
 def patch_theming(body: ThemingIn, user: UserCtx = Depends(require_admin), request: Request = None):
-    merged = {}
-    for k in ("primary", "secondary", "topbar", "accent"):
-        v = getattr(body, k)
-        if v is not None:
-            merged[k] = v
-    out = ajustes_repo.set_theming(merged)
+    out = ajustes_repo.set_theming(patch_dict(body, ajustes_repo._THEMING_KEYS))
     audit_event("ajustes_theming_update", actor_user_id=user.user_id, actor_email=user.email, request=request)
     return out
 
@@ -202,17 +194,20 @@ def patch_theming(body: ThemingIn, user: UserCtx = Depends(require_admin), reque
 # ---------------------------
 @router.post("/logo")
 async def upload_logo(file: UploadFile = File(...), user: UserCtx = Depends(require_admin), request: Request = None):
-    content = await file.read()
-    ajustes_repo.save_logo(content)
+    try:
+        await run_in_threadpool(ajustes_repo.save_logo, file.file)
+    except ValueError as e:
+        raise HTTPException(status_code=413, detail=str(e))
     audit_event("ajustes_logo_upload", actor_user_id=user.user_id, actor_email=user.email, request=request, details={"filename": file.filename})
     return {"ok": True}
 
 @router.get("/logo")
-def get_logo():
+def get_logo(request: Request):
     path = ajustes_repo.get_logo_path()
     if not path:
         raise HTTPException(status_code=404, detail="No hay logo")
-    return FileResponse(path, media_type="image/png")
+    # el logo cambia muy poco: el navegador lo reutiliza una hora sin preguntar
+    return file_response(request, path, media_type="image/png", cache_control="public, max-age=3600")
 
 @router.delete("/logo")
 def delete_logo(user: UserCtx = Depends(require_admin), request: Request = None):
@@ -225,17 +220,12 @@ def delete_logo(user: UserCtx = Depends(require_admin), request: Request = None)
 # Notificaciones
 # ---------------------------
 @router.get("/notifications")
-def get_notifications():
-    return ajustes_repo.get_notifications()
+def get_notifications(request: Request):
+    return etag_response(request, ajustes_repo.get_notifications())
 
 @router.patch("/notifications")
 def patch_notifications(body: NotificationsIn, user: UserCtx = Depends(require_admin), request: Request = None):
-    cfg: Dict[str, Any] = {}
-    if body.admin_emails is not None:
-        cfg["admin_emails"] = [str(e) for e in body.admin_emails]
-    if body.recordatorios is not None:
-        cfg["recordatorios"] = body.recordatorios
-    out = ajustes_repo.set_notifications(cfg)
+    out = ajustes_repo.set_notifications(patch_dict(body, _NOTIFICATIONS_KEYS))
     audit_event("ajustes_notifications_update", actor_user_id=user.user_id, actor_email=user.email, request=request)
     return out
 
@@ -243,20 +233,11 @@ def patch_notifications(body: NotificationsIn, user: UserCtx = Depends(require_a
 # General
 # ---------------------------
 @router.get("/general")
-def get_general():
-    return ajustes_repo.get_general()
+def get_general(request: Request):
+    return etag_response(request, ajustes_repo.get_general())
 
 @router.patch("/general")
 def patch_general(body: GeneralIn, user: UserCtx = Depends(require_admin), request: Request = None):
-    merged: Dict[str, Any] = {}
-    if body.timezone is not None:
-        merged["timezone"] = body.timezone
-    if body.otp is not None:
-        merged["otp"] = body.otp
-    if body.retention is not None:
-        merged["retention"] = body.retention
-    if body.auto_export is not None:
-        merged["auto_export"] = body.auto_export
-    out = ajustes_repo.set_general(merged)
+    out = ajustes_repo.set_general(patch_dict(body, _GENERAL_KEYS))
     audit_event("ajustes_general_update", actor_user_id=user.user_id, actor_email=user.email, request=request)
     return out
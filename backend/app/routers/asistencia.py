@@ -1,22 +1,27 @@
 from __future__ import annotations
-from typing import Optional, List
+from typing import Annotated, Literal, Optional, List
 
 from fastapi import APIRouter, Depends, HTTPException, Query
-from pydantic import BaseModel, Field
+from starlette.concurrency import run_in_threadpool
+from fastapi.responses import ORJSONResponse
+from pydantic import BaseModel, BeforeValidator, Field
 
-from ..deps.auth import get_current_user, UserCtx
-from ..repo import usuarios as usuarios_repo
+from ..deps.auth import get_current_user, require_admin, UserCtx
+from ..utils.patch import patch_dict
+from ..utils.tipos import StrippedStr
 from backend.app.repo import asistencia as asistencia_repo
 from backend.app.repo import solicitudes as solicitudes_repo
+from backend.app.repo import usuarios as usuarios_repo
+from backend.app.repo import exports as exports_repo
 
 router = APIRouter(prefix="/asistencia", tags=["asistencia"])
 
 # ---------- MODELOS ----------
 class NuevaActividadIn(BaseModel):
-    titulo: str = Field(min_length=3, max_length=160)
-    inicio_iso: str
-    fin_iso: str
-    lugar: str | None = Field(default=None, max_length=160)
+    titulo: StrippedStr = Field(min_length=3, max_length=160)
+    inicio_iso: StrippedStr
+    fin_iso: StrippedStr
+    lugar: StrippedStr | None = Field(default=None, max_length=160)
     registro_automatico: bool = True
 
 class ActividadOut(BaseModel):
@@ -31,197 +36,174 @@ class ActividadOut(BaseModel):
     codigo: str | None = None
     estado: str
 
+def _codigo6(v: object) -> str:
+    # Una comprobación directa en lugar de la validación genérica de str
+    if not isinstance(v, str):
+        raise ValueError("codigo inválido")
+    v = v.strip()
+    if len(v) != 6 or not (v.isascii() and v.isdigit()):
+        raise ValueError("codigo inválido")
+    return v
+
+Codigo6 = Annotated[str, BeforeValidator(_codigo6)]
+
 class CheckInCodigoIn(BaseModel):
-    actividad_id: str
-    codigo: str = Field(min_length=6, max_length=6)
+    actividad_id: StrippedStr
+    codigo: Codigo6
 
 
 class CheckOutIn(BaseModel):
-    actividad_id: str
+    actividad_id: StrippedStr
 
 class EditActividadIn(BaseModel):
-    titulo: Optional[str] = None
-    inicio_iso: Optional[str] = None
-    fin_iso: Optional[str] = None
-    lugar: Optional[str] = Field(default=None, max_length=160)
+    titulo: Optional[StrippedStr] = None
+    inicio_iso: Optional[StrippedStr] = None
+    fin_iso: Optional[StrippedStr] = None
+    lugar: Optional[StrippedStr] = Field(default=None, max_length=160)
     registro_automatico: Optional[bool] = None
 
 class EliminarParticipanteIn(BaseModel):
-    user_id: str
+    user_id: StrippedStr
     eliminar: bool = True
     motivo: Optional[str] = Field(default="", max_length=240)
 
 
 class TimeAdjustIn(BaseModel):
-    user_id: str
+    user_id: StrippedStr
     minutos: int
 
 
 class ResolverSolicitudIn(BaseModel):
-    estado: str
+    estado: Literal["aceptada", "denegada"]
     comentario: Optional[str] = None
 
-# ---------- HELPERS ----------
-def _require_admin(user: UserCtx):
-    perfil = usuarios_repo.get_perfil(user.user_id)
-    if not bool(perfil.get("es_admin")):
-        raise HTTPException(status_code=403, detail="Solo administradores")
-
 # ---------- ENDPOINTS ----------
 @router.post("/actividades", response_model=ActividadOut)
-async def crear_actividad(body: NuevaActividadIn, user: UserCtx = Depends(get_current_user)):
-    _require_admin(user)
-    try:
-        act = asistencia_repo.crear_actividad(
-            creador_id=user.user_id,
-            titulo=body.titulo.strip(),
-            inicio_iso=body.inicio_iso.strip(),
-            fin_iso=body.fin_iso.strip(),
-            lugar=(body.lugar or "").strip() or None,
-            registro_automatico=bool(body.registro_automatico),
-        )
-    except ValueError as e:
-        raise HTTPException(status_code=400, detail=str(e))
-    return act
+async def crear_actividad(body: NuevaActividadIn, user: UserCtx = Depends(require_admin)):
+    return asistencia_repo.crear_actividad(
+        creador_id=user.user_id,
+        titulo=body.titulo,
+        inicio_iso=body.inicio_iso,
+        fin_iso=body.fin_iso,
+        lugar=body.lugar or None,
+        registro_automatico=bool(body.registro_automatico),
+    )
 
 @router.get("/actividades", response_model=List[ActividadOut])
-async def listar_actividades(_: UserCtx = Depends(get_current_user)):
-    return asistencia_repo.listar_activas()
+async def listar_actividades(
+    limit: Optional[int] = Query(default=None, ge=1, le=500),
+    offset: int = Query(default=0, ge=0),
+    _: UserCtx = Depends(get_current_user),
+):
+    # El repo ya normaliza cada actividad: se serializa con orjson sin revalidar.
+    # Sin limit se devuelve la lista completa; el total va en X-Total-Count.
+    acts = asistencia_repo.listar_activas()
+    total = len(acts)
+    if limit is not None or offset:
+        acts = acts[offset:None if limit is None else offset + limit]
+    return ORJSONResponse(acts, headers={"X-Total-Count": str(total)})
 
 @router.get("/actividades/{actividad_id}", response_model=ActividadOut)
-async def obtener_actividad(actividad_id: str, _: UserCtx = Depends(get_current_user)):
+async def obtener_actividad(actividad_id: StrippedStr, _: UserCtx = Depends(get_current_user)):
     try:
-        return asistencia_repo.obtener_actividad(actividad_id.strip())
+        return ORJSONResponse(asistencia_repo.obtener_actividad(actividad_id))
     except ValueError as e:
         raise HTTPException(status_code=404, detail=str(e))
 
 @router.patch("/actividades/{actividad_id}", response_model=ActividadOut)
-async def editar_actividad(actividad_id: str, body: EditActividadIn, user: UserCtx = Depends(get_current_user)):
-    _require_admin(user)
-    try:
-        # SOLO enviamos lo que el cliente mandó (sin defaults no enviados)
-        cambios = body.model_dump(exclude_none=True, exclude_unset=True)
-        act = asistencia_repo.editar_actividad(actividad_id.strip(), cambios)
-    except ValueError as e:
-        raise HTTPException(status_code=400, detail=str(e))
-    return act
+async def editar_actividad(actividad_id: StrippedStr, body: EditActividadIn, user: UserCtx = Depends(require_admin)):
+    # SOLO enviamos lo que el cliente mandó (sin defaults no enviados)
+    return asistencia_repo.editar_actividad(actividad_id, patch_dict(body))
 
 
 @router.post("/actividades/{actividad_id}/cerrar", response_model=ActividadOut)
-async def cerrar_actividad(actividad_id: str, user: UserCtx = Depends(get_current_user)):
-    _require_admin(user)
-    try:
-        act = asistencia_repo.cerrar_actividad(actividad_id.strip())
-    except ValueError as e:
-        raise HTTPException(status_code=400, detail=str(e))
-    return act
+async def cerrar_actividad(actividad_id: StrippedStr, user: UserCtx = Depends(require_admin)):
+    return asistencia_repo.cerrar_actividad(actividad_id)
 
 
 @router.delete("/actividades/{actividad_id}")
-async def eliminar_actividad(actividad_id: str, user: UserCtx = Depends(get_current_user)):
-    _require_admin(user)
-    try:
-        asistencia_repo.eliminar_actividad(actividad_id.strip())
-    except ValueError as e:
-        raise HTTPException(status_code=400, detail=str(e))
+async def eliminar_actividad(actividad_id: StrippedStr, user: UserCtx = Depends(require_admin)):
+    asistencia_repo.eliminar_actividad(actividad_id)
     return {"ok": True}
 
 @router.post("/check-in")
 async def check_in(body: CheckInCodigoIn, user: UserCtx = Depends(get_current_user)):
-    try:
-        return asistencia_repo.registrar_check_in_codigo(
-            user.user_id, body.actividad_id.strip(), body.codigo.strip()
-        )
-    except ValueError as e:
-        raise HTTPException(status_code=400, detail=str(e))
+    return asistencia_repo.registrar_check_in_codigo(
+        user.user_id, body.actividad_id, body.codigo
+    )
 
 
 @router.post("/check-out")
 async def check_out(body: CheckOutIn, user: UserCtx = Depends(get_current_user)):
-    try:
-        return asistencia_repo.registrar_check(
-            user_id=user.user_id,
-            actividad_id=body.actividad_id.strip(),
-            accion="out",
-        )
-    except ValueError as e:
-        raise HTTPException(status_code=400, detail=str(e))
+    return asistencia_repo.registrar_check(
+        user_id=user.user_id,
+        actividad_id=body.actividad_id,
+        accion="out",
+    )
 
 @router.get("/mis-checkins")
 async def mis_checkins(
     actividad_id: Optional[str] = Query(default=None),
     user: UserCtx = Depends(get_current_user),
 ):
-    return asistencia_repo.mis_checkins(user.user_id, actividad_id)
+    return ORJSONResponse(asistencia_repo.mis_checkins(user.user_id, actividad_id))
 
 @router.get("/actividades/{actividad_id}/participantes")
-async def participantes(actividad_id: str, user: UserCtx = Depends(get_current_user)):
-    _require_admin(user)
-    return asistencia_repo.participantes_de_actividad(actividad_id.strip())
+async def participantes(actividad_id: StrippedStr, user: UserCtx = Depends(require_admin)):
+    return ORJSONResponse(asistencia_repo.participantes_de_actividad(actividad_id))
 
 
 @router.get("/actividades/{actividad_id}/codigo")
-async def obtener_codigo(actividad_id: str, user: UserCtx = Depends(get_current_user)):
-    _require_admin(user)
-    try:
-        codigo = asistencia_repo.obtener_codigo(actividad_id.strip())
-    except ValueError as e:
-        raise HTTPException(status_code=400, detail=str(e))
-    return {"codigo": codigo}
+async def obtener_codigo(actividad_id: StrippedStr, user: UserCtx = Depends(require_admin)):
+    return {"codigo": asistencia_repo.obtener_codigo(actividad_id)}
 
 
 @router.get("/actividades/{actividad_id}/solicitudes")
-async def solicitudes_actividad(actividad_id: str, user: UserCtx = Depends(get_current_user)):
-    _require_admin(user)
-    return {"items": solicitudes_repo.listar_por_actividad(actividad_id.strip())}
+async def solicitudes_actividad(actividad_id: StrippedStr, user: UserCtx = Depends(require_admin)):
+    items = solicitudes_repo.listar_por_actividad(actividad_id)
+    # Nombre y NIU del solicitante en la misma respuesta (evita una consulta por fila)
+    perfiles = usuarios_repo.get_perfiles_many(sol.get("user_id") or "" for sol in items)
+    for sol in items:
+        p = perfiles.get(sol.get("user_id") or "", {})
+        sol["nombre"] = p.get("nombre") or ""
+        sol["niu"] = p.get("niu") or ""
+    return {"items": items}
 
 
 @router.post("/actividades/{actividad_id}/solicitudes/{sol_id}/resolver")
-async def resolver_solicitud(actividad_id: str, sol_id: str, body: ResolverSolicitudIn, user: UserCtx = Depends(get_current_user)):
-    _require_admin(user)
-    try:
-        rec = solicitudes_repo.resolver(
-            sol_id.strip(), body.estado, user.user_id, body.comentario
+async def resolver_solicitud(actividad_id: StrippedStr, sol_id: StrippedStr, body: ResolverSolicitudIn, user: UserCtx = Depends(require_admin)):
+    rec = solicitudes_repo.resolver(
+        sol_id, body.estado, user.user_id, body.comentario
+    )
+    if rec.get("estado") == "aceptada" and rec.get("tipo") == "asistencia":
+        asistencia_repo.registrar_check(
+            user_id=rec.get("user_id"),
+            actividad_id=rec.get("actividad_id"),
+            accion=rec.get("accion", "in"),
         )
-        if rec.get("estado") == "aceptada" and rec.get("tipo") == "asistencia":
-            asistencia_repo.registrar_check(
-                user_id=rec.get("user_id"),
-                actividad_id=rec.get("actividad_id"),
-                accion=rec.get("accion", "in"),
-            )
-    except ValueError as e:
-        raise HTTPException(status_code=400, detail=str(e))
     return {"ok": True, "solicitud": rec}
 
 @router.post("/actividades/{actividad_id}/time")
-async def ajustar_tiempo_endpoint(actividad_id: str, body: TimeAdjustIn, user: UserCtx = Depends(get_current_user)):
-    _require_admin(user)
-    try:
-        participante = asistencia_repo.ajustar_tiempo(
-            actividad_id.strip(), body.user_id.strip(), int(body.minutos)
-        )
-    except ValueError as e:
-        raise HTTPException(status_code=400, detail=str(e))
+async def ajustar_tiempo_endpoint(actividad_id: StrippedStr, body: TimeAdjustIn, user: UserCtx = Depends(require_admin)):
+    participante = asistencia_repo.ajustar_tiempo(
+        actividad_id, body.user_id, int(body.minutos)
+    )
     return {"ok": True, "participante": participante}
 
 @router.post("/actividades/{actividad_id}/eliminar-participante")
-async def eliminar_participante(actividad_id: str, body: EliminarParticipanteIn, user: UserCtx = Depends(get_current_user)):
-    _require_admin(user)
+async def eliminar_participante(actividad_id: StrippedStr, body: EliminarParticipanteIn, user: UserCtx = Depends(require_admin)):
     rec = asistencia_repo.set_eliminado(
-        actividad_id.strip(), body.user_id.strip(),
+        actividad_id, body.user_id,
         bool(body.eliminar), body.motivo or "", user.user_id
     )
     estado = "eliminado" if body.eliminar else "restaurado"
     return {"ok": True, "estado": estado, "registro": rec}
 
 
-# backend/app/routers/asistencia.py  (añadir al final del archivo)
-from ..repo import exports as exports_repo
-from fastapi import Response
-
 @router.get("/{reunion_id}/export")
-async def export_reunion(reunion_id: str, user: UserCtx = Depends(get_current_user)):
-    # Si quieres que sea solo admin, usa aquí tu verificación de admin
-    csv_path = exports_repo.export_asistencia_csv(reunion_id.strip())
+async def export_reunion(reunion_id: StrippedStr, user: UserCtx = Depends(get_current_user)):
+    try:
+        csv_path = await run_in_threadpool(exports_repo.export_asistencia_csv, reunion_id)
+    except FileNotFoundError:
+        raise HTTPException(status_code=404, detail="Reunión no encontrada")
     return {"ok": True, "csv": csv_path}
-
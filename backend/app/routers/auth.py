@@ -1,12 +1,13 @@
 from __future__ import annotations
 
 from fastapi import APIRouter, HTTPException, Request
-from pydantic import BaseModel, EmailStr
+from pydantic import BaseModel
 
 from ..deps.auth import UserCtx  # (solo para tipos; no es dependencia aquí)
 from ..utils.tokens import create_token
 from ..utils.ratelimit import limit_by_ip, limit_by_key
 from ..utils.audit import audit_event
+from ..utils.tipos import EmailNorm
 from ..config import settings
 from ..repo import usuarios as usuarios_repo
 from ..repo import ajustes as ajustes_repo
@@ -17,11 +18,11 @@ router = APIRouter(prefix="/auth", tags=["auth"])
 
 # --------- Schemas ---------
 class OtpRequestIn(BaseModel):
-    email: EmailStr
+    email: EmailNorm
 
 
 class OtpVerifyIn(BaseModel):
-    email: EmailStr
+    email: EmailNorm
     otp: str
 
 
@@ -36,16 +37,15 @@ async def request_otp(body: OtpRequestIn, request: Request):
       - Si ya hay usuarios: el email debe existir en el sistema -> 403 si no existe.
       - Rate limit por IP y por email para evitar abuso.
     """
-    email = body.email.strip().lower()
-    domain = email.split("@")[-1]
+    email = body.email
+    domain = email.rpartition("@")[2]
 
     # Rate-limit (p. ej. 5 peticiones/min por IP y 5/min por email)
-    limit_by_ip(request, scope="otp_request", limit=5, window_s=60)
-    limit_by_key(email, scope="otp_request", limit=5, window_s=60)
+    await limit_by_ip(request, scope="otp_request", limit=5, window_s=60)
+    await limit_by_key(email, scope="otp_request", limit=5, window_s=60)
 
     # Dominio permitido
-    allowed = ajustes_repo.get_allowed_domains()
-    if allowed and domain not in allowed:
+    if not ajustes_repo.is_allowed_domain(domain):
         audit_event("otp_request_denied_domain", actor_email=email, request=request, details={"domain": domain})
         raise HTTPException(status_code=403, detail="Dominio no permitido")
 
@@ -74,7 +74,7 @@ async def request_otp(body: OtpRequestIn, request: Request):
         }
 
     # Ya hay usuarios -> el email debe existir
-    if not usuarios_repo.user_exists_by_email(email):
+    if usuarios_repo.get_active_user_id_by_email(email) is None:
         audit_event("otp_request_denied_unknown_email", actor_email=email, request=request)
         raise HTTPException(status_code=403, detail="No estás dado de alta. Solicita acceso.")
 
@@ -96,13 +96,14 @@ async def verify_otp(body: OtpVerifyIn, request: Request):
       - Requiere que el usuario exista (salvo bootstrap ya realizado).
       - Emite JWT HS256 con sub=user_id, email, iat/exp.
     """
-    email = body.email.strip().lower()
+    email = body.email
 
     # (Leve) rate-limit de verificación por IP
-    limit_by_ip(request, scope="otp_verify", limit=10, window_s=60)
+    await limit_by_ip(request, scope="otp_verify", limit=10, window_s=60)
 
     # El usuario debe existir (si hubo bootstrap ya se habrá creado)
-    if not usuarios_repo.user_exists_by_email(email):
+    user_id = usuarios_repo.get_active_user_id_by_email(email)
+    if user_id is None:
         audit_event("otp_verify_denied_unknown_email", actor_email=email, request=request)
         raise HTTPException(status_code=403, detail="No estás dado de alta. Solicita acceso.")
 
@@ -112,8 +113,7 @@ async def verify_otp(body: OtpVerifyIn, request: Request):
         audit_event("otp_failed", actor_email=email, request=request)
         raise HTTPException(status_code=400, detail=msg)
 
-    # Obtener user_id y asegurar enlaces básicos
-    user_id = usuarios_repo.get_user_id_by_email(email)
+    # Asegurar enlaces básicos
     usuarios_repo.ensure_profile_links_if_exists(user_id, email)
 
     # Crear token
@@ -8,6 +8,7 @@ from ..config import settings
 from ..emailer import send_test_email
 from ..repo import usuarios as usuarios_repo
 from ..utils import backups
+from ..utils.tipos import EmailNorm
 
 router = APIRouter(prefix="/_dev", tags=["_dev"])
 
@@ -23,13 +24,13 @@ async def dev_test_email(body: TestEmailIn, user: UserCtx = Depends(get_current_
     return {"sent_to": to}
 
 class RepairUserIn(BaseModel):
-    email: EmailStr
+    email: EmailNorm
 
 @router.post("/repair-user")
 async def repair_user(body: RepairUserIn, user: UserCtx = Depends(get_current_user)):
     if not settings.dev_mode:
         raise HTTPException(status_code=403, detail="Solo disponible con DEV_MODE=true")
-    email = body.email.strip().lower()
+    email = body.email
     user_id = usuarios_repo.get_or_create_user_by_email(email)
     usuarios_repo.ensure_profile_links(user_id, email)
     return usuarios_repo.get_perfil(user_id)
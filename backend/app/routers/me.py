@@ -1,10 +1,12 @@
 from __future__ import annotations
 
 from typing import Optional, Dict
-from fastapi import APIRouter, Depends, HTTPException
+from fastapi import APIRouter, Depends, HTTPException, Request
+from starlette.concurrency import run_in_threadpool
 from pydantic import BaseModel, Field
 
 from ..deps.auth import get_current_user, UserCtx
+from ..deps.etag import etag_response
 from ..repo import usuarios as usuarios_repo
 from ..repo import ajustes as ajustes_repo
 from ..repo import solicitudes as solicitudes_repo
@@ -24,6 +26,10 @@ class PerfilUpdateIn(BaseModel):
 
 
 # --------- Helpers ---------
+# Campos editables de PerfilUpdateIn, en el orden en que se procesan
+_CAMPOS_PERFIL = ("nombre", "grupo", "curso", "niu")
+
+
 def _normaliza_val(v: Optional[str]) -> Optional[str]:
     if v is None:
         return None
@@ -31,52 +37,36 @@ def _normaliza_val(v: Optional[str]) -> Optional[str]:
     return v if v else None
 
 
+# Reglas mínimas si ajustes no define alguno de los campos editables
+_REGLAS_DEFAULT: Dict[str, Dict[str, str]] = {
+    "nombre": {"edicion": "libre"},
+    "grupo": {"edicion": "libre"},
+    "curso": {"edicion": "libre"},
+    "niu": {"edicion": "aprobacion"},
+}
+
+
 def _cargar_reglas_perfil() -> Dict[str, Dict[str, str]]:
     """
-    Intenta cargar reglas de edición desde ajustes_repo.
-    Si no existen, aplica defaults razonables:
+    Reglas de edición de ajustes (``get_perfil_reglas``, ya normalizadas y
+    cacheadas en el repo) completadas con ``_REGLAS_DEFAULT``:
       - nombre/grupo/curso: libre
       - niu: aprobación (según comentario del esquema)
-    El formato esperado es: { campo: {"edicion": "libre|aprobacion|bloqueado"} }
+    Formato: { campo: {"edicion": "libre|aprobacion|bloqueado", ...} }
     """
-    reglas: Dict[str, Dict[str, str]] = {}
-    # Intentos de compatibilidad con distintas implementaciones del repo de ajustes
-    getter = getattr(ajustes_repo, "get_reglas_perfil", None)
-    if callable(getter):
-        reglas = getter() or {}
-    else:
-        getter2 = getattr(ajustes_repo, "get", None)
-        if callable(getter2):
-            # prueba varias claves comunes
-            for key in ("perfil.reglas", "reglas_perfil", "perfil_edicion"):
-                try:
-                    reglas = getter2(key) or {}
-                    if reglas:
-                        break
-                except Exception:
-                    pass
-
-    defaults = {
-        "nombre": {"edicion": "libre"},
-        "grupo": {"edicion": "libre"},
-        "curso": {"edicion": "libre"},
-        "niu": {"edicion": "aprobacion"},
-    }
-    # Mezcla: lo que falte en reglas se completa con defaults
-    for k, v in defaults.items():
-        reglas.setdefault(k, v)
-        reglas[k].setdefault("edicion", v["edicion"])
-    return reglas
+    return {**_REGLAS_DEFAULT, **ajustes_repo.get_perfil_reglas()}
 
 
 # --------- Endpoints ---------
 @router.get("/perfil")
-async def get_perfil(user: UserCtx = Depends(get_current_user)):
+async def get_perfil(request: Request, user: UserCtx = Depends(get_current_user)):
     """
     Devuelve el perfil del usuario autenticado.
     """
     perfil = usuarios_repo.get_perfil(user.user_id) or {}
-    return {"ok": True, "perfil": perfil}
+    # Directo a orjson (sin jsonable_encoder) y 304 si no ha cambiado: lo
+    # consulta el frontend en cada página
+    return etag_response(request, {"ok": True, "perfil": perfil})
 
 
 @router.patch("/perfil")
@@ -88,35 +78,30 @@ async def actualizar_perfil(body: PerfilUpdateIn, user: UserCtx = Depends(get_cu
       - bloqueado (o desconocido): no se permite
     Solo se procesan campos enviados con valor no-nulo (tras trim).
     """
-    reglas = _cargar_reglas_perfil()
-
-    # Normaliza entrada
-    entrada = {
-        "nombre": _normaliza_val(body.nombre),
-        "grupo": _normaliza_val(body.grupo),
-        "curso": _normaliza_val(body.curso),
-        "niu": _normaliza_val(body.niu),
-    }
-
     # Estado inicial
     pendientes: list[str] = []
     bloqueados: list[str] = []
     cambios: Dict[str, str] = {}
+    entrada: Dict[str, str] = {}
+
+    # Solo los campos enviados (ya normalizados); sin ellos no hace falta
+    # leer reglas ni perfil
+    for campo in _CAMPOS_PERFIL:
+        v = _normaliza_val(getattr(body, campo))
+        if v is not None:
+            entrada[campo] = v
 
     perfil_antes = usuarios_repo.get_perfil(user.user_id) or {}
+    if entrada:
+        reglas = _cargar_reglas_perfil()
 
     # Decide por campo
     for campo, nuevo_valor in entrada.items():
-        if nuevo_valor is None:
-            continue  # no cambiar este campo
-
         # Ignora campos que no cambian realmente
         if perfil_antes.get(campo) == nuevo_valor:
             continue
 
-        conf = reglas.get(campo, {})
-        ed = str(conf.get("edicion", "bloqueado")).lower()
-
+        ed = str(reglas.get(campo, {}).get("edicion", "bloqueado")).lower()
         if ed == "libre":
             cambios[campo] = nuevo_valor
         elif ed == "aprobacion":
@@ -171,7 +156,8 @@ async def exportar_mis_datos(user: UserCtx = Depends(get_current_user)):
     Devuelve la ruta del fichero generado.
     """
     try:
-        path = write_user_export(user.user_id)
+        # Recorre asistencias y votaciones en disco: fuera del event loop
+        path = await run_in_threadpool(write_user_export, user.user_id)
     except Exception as e:
         audit_event("rgpd_export_failed", actor_user_id=user.user_id, actor_email=user.email, details={"error": str(e)})
         raise HTTPException(status_code=500, detail="No se pudo generar la exportación de datos.")
@@ -1,22 +1,22 @@
 from __future__ import annotations
 
-import asyncio
 from typing import Optional
 
 from fastapi import APIRouter, Request
-from pydantic import BaseModel, EmailStr, Field
+from pydantic import BaseModel, Field
 
 from ..repo import solicitudes as solicitudes_repo
 from ..repo import ajustes as ajustes_repo
 from ..utils.ratelimit import limit_by_ip, limit_by_key
 from ..utils.audit import audit_event
-from ..emailer import send_email
+from ..utils.tipos import EmailNorm
+from ..emailer import enqueue_email
 
 router = APIRouter(prefix="/solicitudes", tags=["solicitudes"])
 
 
 class SolicitudAltaIn(BaseModel):
-    email: EmailStr
+    email: EmailNorm
     nombre: Optional[str] = Field(default=None)
     niu: Optional[str] = Field(default=None)
     mensaje: Optional[str] = Field(default=None)
@@ -32,11 +32,11 @@ def _clean(v: Optional[str]) -> Optional[str]:
 @router.post("/alta")
 async def solicitar_alta(body: SolicitudAltaIn, request: Request):
     """Permite que un usuario solicite su alta en el sistema."""
-    email = body.email.strip().lower()
+    email = body.email
 
     # Rate-limit por IP y por email para evitar abuso
-    limit_by_ip(request, scope="solicitud_alta", limit=5, window_s=60)
-    limit_by_key(email, scope="solicitud_alta", limit=5, window_s=60)
+    await limit_by_ip(request, scope="solicitud_alta", limit=5, window_s=60)
+    await limit_by_key(email, scope="solicitud_alta", limit=5, window_s=60)
 
     payload = {
         "email": email,
@@ -58,8 +58,8 @@ async def solicitar_alta(body: SolicitudAltaIn, request: Request):
                 f"NIU: {payload['niu'] or ''}\n"
                 f"Mensaje: {payload['mensaje'] or ''}"
             )
-            for adm in admin_emails:
-                asyncio.create_task(send_email(adm, "Nueva solicitud de alta", texto))
+            # Un único correo para todos los admins (en copia oculta)
+            enqueue_email(admin_emails, "Nueva solicitud de alta", texto)
     except Exception:
         pass
 
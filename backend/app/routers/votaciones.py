@@ -1,10 +1,12 @@
 from __future__ import annotations
 from typing import Optional, List
 
-from fastapi import APIRouter, Depends, HTTPException, Response
+from fastapi import APIRouter, Depends, Request, Response
 from pydantic import BaseModel, Field
 
-from ..deps.auth import get_current_user, UserCtx
+from ..deps.auth import get_current_user, require_admin, UserCtx
+from ..deps.etag import etag_json_response
+from ..utils.patch import patch_dict
 from ..repo import usuarios as usuarios_repo
 from ..repo import votaciones as repo
 
@@ -64,70 +66,50 @@ class EmitirVotoIn(BaseModel):
 
 
 # -------------------- Helpers --------------------
-def _require_admin(user: UserCtx):
-    perfil = usuarios_repo.get_perfil(user.user_id)
-    if not bool(perfil.get("es_admin")):
-        raise HTTPException(status_code=403, detail="Solo administradores")
-
-
 # -------------------- Endpoints --------------------
 @router.get("", response_model=List[VotacionOut])
-async def listar(_: UserCtx = Depends(get_current_user)):
-    return repo.listar_vigentes()
+async def listar(request: Request, _: UserCtx = Depends(get_current_user)):
+    # JSON precalculado en el repo: se envía tal cual, sin revalidar (304 si no cambió)
+    return etag_json_response(request, repo.listar_vigentes_json())
 
 @router.post("", response_model=VotacionOut)
-async def crear(body: NuevaVotacionIn, user: UserCtx = Depends(get_current_user)):
-    _require_admin(user)
-    try:
-        v = repo.crear_votacion(
-            creador_id=user.user_id,
-            titulo=body.titulo,
-            opciones=body.opciones,
-            inicio_iso=body.inicio_iso,
-            fin_iso=body.fin_iso,
-            descripcion=body.descripcion,
-            permitir_cambiar=body.permitir_cambiar,
-            permite_fuera_de_hora=body.permite_fuera_de_hora,
-            secreto=body.secreto,
-            quorum_minimo=body.quorum_minimo,
-            respuesta_abierta=body.respuesta_abierta,
-            respuesta_abierta_etiqueta=body.respuesta_abierta_etiqueta,
-        )
-        return v
-    except ValueError as e:
-        raise HTTPException(status_code=400, detail=str(e))
+async def crear(body: NuevaVotacionIn, user: UserCtx = Depends(require_admin)):
+    v = repo.crear_votacion(
+        creador_id=user.user_id,
+        titulo=body.titulo,
+        opciones=body.opciones,
+        inicio_iso=body.inicio_iso,
+        fin_iso=body.fin_iso,
+        descripcion=body.descripcion,
+        permitir_cambiar=body.permitir_cambiar,
+        permite_fuera_de_hora=body.permite_fuera_de_hora,
+        secreto=body.secreto,
+        quorum_minimo=body.quorum_minimo,
+        respuesta_abierta=body.respuesta_abierta,
+        respuesta_abierta_etiqueta=body.respuesta_abierta_etiqueta,
+    )
+    # VotacionOut queda solo para la documentación: el repo ya garantiza la forma
+    return Response(content=repo.votacion_json(v), media_type="application/json")
 
 @router.patch("/{votacion_id}", response_model=VotacionOut)
-async def editar(votacion_id: str, body: EditVotacionIn, user: UserCtx = Depends(get_current_user)):
-    _require_admin(user)
-    try:
-        cambios = body.model_dump(exclude_none=True, exclude_unset=True)
-        v = repo.editar_votacion(votacion_id.strip(), cambios)
-        return v
-    except ValueError as e:
-        raise HTTPException(status_code=400, detail=str(e))
+async def editar(votacion_id: str, body: EditVotacionIn, user: UserCtx = Depends(require_admin)):
+    v = repo.editar_votacion(votacion_id.strip(), patch_dict(body))
+    return Response(content=repo.votacion_json(v), media_type="application/json")
 
 @router.post("/votar")
 async def votar(body: EmitirVotoIn, user: UserCtx = Depends(get_current_user)):
-    try:
-        return repo.emitir_voto(
-            user.user_id,
-            body.votacion_id.strip(),
-            opcion=(body.opcion.strip() if body.opcion else None),
-            texto_abierto=(body.texto_abierto.strip() if body.texto_abierto else None),
-        )
-    except ValueError as e:
-        raise HTTPException(status_code=400, detail=str(e))
+    return repo.emitir_voto(
+        user.user_id,
+        body.votacion_id.strip(),
+        opcion=(body.opcion.strip() if body.opcion else None),
+        texto_abierto=(body.texto_abierto.strip() if body.texto_abierto else None),
+    )
 
 @router.get("/{votacion_id}/resultados")
 async def resultados(votacion_id: str, user: UserCtx = Depends(get_current_user)):
     # Si la votación es secreta, solo admins ven detalle; el resto, agregados.
-    perfil = usuarios_repo.get_perfil(user.user_id)
-    incluir_detalle = bool(perfil.get("es_admin"))
-    try:
-        return repo.resultados(votacion_id.strip(), incluir_detalle=incluir_detalle)
-    except ValueError as e:
-        raise HTTPException(status_code=400, detail=str(e))
+    incluir_detalle = user.es_admin
+    return repo.resultados(votacion_id.strip(), incluir_detalle=incluir_detalle)
 
 @router.get("/mis")
 async def mis_votos(user: UserCtx = Depends(get_current_user)):
@@ -140,23 +122,21 @@ async def participacion(votacion_id: str, user: UserCtx = Depends(get_current_us
     Lista el último voto por usuario (si la votación es secreta, solo IDs y opción/texto;
     si no es secreta y eres admin, será lo mismo pero ya puedes exportar con detalle).
     """
-    try:
-        parts = repo.participantes(votacion_id.strip())
-        # enriquecemos con perfil básico
-        out = []
-        for p in parts:
-            perfil = usuarios_repo.get_perfil(p["user_id"])
-            out.append({
-                "user_id": p["user_id"],
-                "email": perfil.get("email"),
-                "nombre": perfil.get("nombre"),
-                "opcion": p.get("opcion"),
-                "texto_abierto": p.get("texto_abierto"),
-                "ts": p.get("ts"),
-            })
-        return {"total": len(out), "items": out}
-    except ValueError as e:
-        raise HTTPException(status_code=400, detail=str(e))
+    parts = repo.participantes(votacion_id.strip())
+    # enriquecemos con perfil básico (una lectura por usuario, no por voto)
+    perfiles = usuarios_repo.get_perfiles_many(p["user_id"] for p in parts)
+    out = []
+    for p in parts:
+        perfil = perfiles.get(p["user_id"], {})
+        out.append({
+            "user_id": p["user_id"],
+            "email": perfil.get("email"),
+            "nombre": perfil.get("nombre"),
+            "opcion": p.get("opcion"),
+            "texto_abierto": p.get("texto_abierto"),
+            "ts": p.get("ts"),
+        })
+    return {"total": len(out), "items": out}
 
 # ---------- NUEVO: export CSV ----------
 @router.get("/{votacion_id}/export.csv")
@@ -166,17 +146,13 @@ async def export_csv(votacion_id: str, user: UserCtx = Depends(get_current_user)
     - Si la votación es NO secreta y eres admin -> detalle por usuario.
     - Si es secreta o no eres admin -> agregado.
     """
-    perfil = usuarios_repo.get_perfil(user.user_id)
-    incluir_detalle = bool(perfil.get("es_admin"))
-    try:
-        csv_str = repo.export_csv(votacion_id.strip(), incluir_detalle=incluir_detalle)
-        return Response(
-            content=csv_str,
-            media_type="text/csv; charset=utf-8",
-            headers={"Content-Disposition": f'attachment; filename="votacion_{votacion_id}.csv"'}
-        )
-    except ValueError as e:
-        raise HTTPException(status_code=400, detail=str(e))
+    incluir_detalle = user.es_admin
+    csv_str = repo.export_csv(votacion_id.strip(), incluir_detalle=incluir_detalle)
+    return Response(
+        content=csv_str,
+        media_type="text/csv; charset=utf-8",
+        headers={"Content-Disposition": f'attachment; filename="votacion_{votacion_id}.csv"'}
+    )
     
 # backend/app/routers/votaciones.py  (añadir al final del archivo)
 from ..repo import exports as exports_repo
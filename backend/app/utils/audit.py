@@ -1,20 +1,123 @@
 from __future__ import annotations
 
+import asyncio
+import atexit
+import time
 from pathlib import Path
-from datetime import datetime, timezone
-from typing import Any, Dict, Optional
+from datetime import datetime, time as dt_time, timedelta, timezone
+from typing import Any, Dict, List, Optional, Tuple
 
 from fastapi import Request
 
 from ..config import settings
-from ..repo.base import append_jsonl, ensure_dir
+from ..repo.base import append_jsonl, append_jsonl_many, ensure_dir
 
 DATA_DIR = Path(settings.data_dir)
 LOG_DIR = DATA_DIR / "logs"
 ensure_dir(LOG_DIR)
 
+# Cola de eventos: un único worker los agrupa y escribe por lotes
+_QUEUE_MAX = 10_000
+_LOTE_MAX = 200
+_LOTE_ESPERA_S = 0.25
+
+_loop: Optional[asyncio.AbstractEventLoop] = None
+_queue: Optional[asyncio.Queue] = None
+_worker: Optional[asyncio.Task] = None
+
+# (instante de la próxima medianoche local, fichero del día en curso)
+_DIA: Tuple[float, Optional[Path]] = (0.0, None)
+
 def _today_path() -> Path:
-    return LOG_DIR / f"audit_{datetime.now().strftime('%Y%m%d')}.jsonl"
+    global _DIA
+    hasta, path = _DIA
+    if path is not None and time.time() < hasta:
+        return path
+    hoy = datetime.now()
+    manana = datetime.combine(hoy.date() + timedelta(days=1), dt_time.min)
+    path = LOG_DIR / f"audit_{hoy.strftime('%Y%m%d')}.jsonl"
+    _DIA = (manana.timestamp(), path)
+    return path
+
+def _escribir_lote(lote: List[Tuple[Path, Dict[str, Any]]]) -> None:
+    # Agrupa por fichero (un lote puede cruzar la medianoche) manteniendo el orden
+    por_fichero: Dict[Path, List[Dict[str, Any]]] = {}
+    for path, rec in lote:
+        por_fichero.setdefault(path, []).append(rec)
+    for path, recs in por_fichero.items():
+        append_jsonl_many(path, recs)
+
+def _encolar(item: Tuple[Path, Dict[str, Any]]) -> None:
+    q = _queue
+    if q is None:
+        append_jsonl(item[0], item[1])
+        return
+    if q.full():
+        # Descarta el más antiguo antes que bloquear la petición
+        try:
+            q.get_nowait()
+        except asyncio.QueueEmpty:
+            pass
+    q.put_nowait(item)
+
+async def _audit_worker() -> None:
+    assert _queue is not None and _loop is not None
+    while True:
+        lote: List[Tuple[Path, Dict[str, Any]]] = []
+        try:
+            lote.append(await _queue.get())
+            limite = _loop.time() + _LOTE_ESPERA_S
+            while len(lote) < _LOTE_MAX:
+                restante = limite - _loop.time()
+                if restante <= 0:
+                    break
+                try:
+                    lote.append(await asyncio.wait_for(_queue.get(), restante))
+                except asyncio.TimeoutError:
+                    break
+        except asyncio.CancelledError:
+            # Parada: lo ya sacado de la cola se escribe aquí mismo
+            if lote:
+                _escribir_lote(lote)
+            raise
+        try:
+            await asyncio.to_thread(_escribir_lote, lote)
+        except Exception:
+            # La auditoría nunca debe tumbar el worker
+            pass
+
+async def start_audit_worker() -> None:
+    """Arranca el worker de auditoría en el event loop actual (startup)."""
+    global _loop, _queue, _worker
+    if _worker is not None:
+        return
+    _loop = asyncio.get_running_loop()
+    _queue = asyncio.Queue(maxsize=_QUEUE_MAX)
+    _worker = _loop.create_task(_audit_worker())
+
+async def stop_audit_worker() -> None:
+    """Para el worker y vuelca lo pendiente (shutdown)."""
+    global _loop, _queue, _worker
+    if _worker is None:
+        return
+    _worker.cancel()
+    try:
+        await _worker
+    except asyncio.CancelledError:
+        pass
+    _vaciar_cola()
+    _loop = _queue = _worker = None
+
+def _vaciar_cola() -> None:
+    """Escribe de golpe lo que quede en la cola (shutdown o salida del proceso)."""
+    pendientes: List[Tuple[Path, Dict[str, Any]]] = []
+    while _queue is not None and not _queue.empty():
+        pendientes.append(_queue.get_nowait())
+    if pendientes:
+        _escribir_lote(pendientes)
+
+# Si el proceso termina sin pasar por el shutdown de la app, no se pierde la cola
+atexit.register(_vaciar_cola)
 
 def audit_event(
     event: str,
@@ -39,4 +142,18 @@ def audit_event(
             # Evita loggear tokens/secretos en query
         except Exception:
             pass
-    append_jsonl(_today_path(), rec)
+    item = (_today_path(), rec)
+    loop = _loop
+    if loop is None:
+        # Sin worker (scripts, tareas fuera de la app): escritura directa
+        append_jsonl(item[0], item[1])
+        return
+    try:
+        en_loop = asyncio.get_running_loop() is loop
+    except RuntimeError:
+        en_loop = False
+    if en_loop:
+        _encolar(item)
+    else:
+        # Handlers síncronos corren en el threadpool: asyncio.Queue no es thread-safe
+        loop.call_soon_threadsafe(_encolar, item)
@@ -1,10 +1,11 @@
 # backend/app/utils/backups.py
 from __future__ import annotations
 
+import os
 import zipfile
 from pathlib import Path
 from datetime import datetime
-from typing import Optional
+from typing import Iterator, Optional, Tuple
 
 try:
     # Opcional (si está instalado)
@@ -19,6 +20,26 @@ from ..config import settings
 DATA_DIR = Path(settings.data_dir)
 BACKUPS_DIR = DATA_DIR / "backups"
 EXCLUDE_DIRS = {"backups"}  # evita anidar backups dentro del zip
+# Ficheros pequeños (JSON de perfiles, índices...) van sin comprimir: deflate
+# apenas gana bytes y es lo que más CPU gasta en el backup.
+_STORED_MAX_BYTES = 4096
+
+
+def _iter_ficheros(root: str, rel: str = "") -> Iterator[Tuple[str, str, int]]:
+    """(ruta, ruta relativa, tamaño) de cada fichero bajo ``root``.
+
+    Recorrido con os.scandir: el tipo y el tamaño salen de la propia entrada
+    del directorio y las carpetas excluidas se podan sin entrar en ellas.
+    """
+    with os.scandir(root) as it:
+        for entry in it:
+            arc = f"{rel}/{entry.name}" if rel else entry.name
+            if entry.is_dir(follow_symlinks=False):
+                if not rel and entry.name in EXCLUDE_DIRS:
+                    continue
+                yield from _iter_ficheros(entry.path, arc)
+            elif entry.is_file():
+                yield entry.path, arc, entry.stat().st_size
 
 
 def create_backup_zip(prefix: Optional[str] = None) -> str:
@@ -37,19 +58,12 @@ def create_backup_zip(prefix: Optional[str] = None) -> str:
         zip_path = BACKUPS_DIR / f"{base_name}_{i}.zip"
         i += 1
 
-    with zipfile.ZipFile(zip_path, "w", compression=zipfile.ZIP_DEFLATED) as zf:
-        for p in DATA_DIR.rglob("*"):
-            if p.is_dir():
-                # saltar carpetas excluidas
-                rel_parts = p.relative_to(DATA_DIR).parts
-                if rel_parts and rel_parts[0] in EXCLUDE_DIRS:
-                    continue
-                continue
-            rel = p.relative_to(DATA_DIR)
-            # excluir archivos dentro de carpetas excluidas
-            if rel.parts and rel.parts[0] in EXCLUDE_DIRS:
-                continue
-            zf.write(p, arcname=str(rel))
+    with zipfile.ZipFile(zip_path, "w", compression=zipfile.ZIP_DEFLATED, compresslevel=1) as zf:
+        for path, arcname, size in _iter_ficheros(str(DATA_DIR)):
+            if size < _STORED_MAX_BYTES:
+                zf.write(path, arcname=arcname, compress_type=zipfile.ZIP_STORED)
+            else:
+                zf.write(path, arcname=arcname)
     return str(zip_path)
 
 
@@ -69,4 +83,7 @@ def start_scheduler() -> None:
     tz = zoneinfo.ZoneInfo("Europe/Madrid")
     _scheduler = AsyncIOScheduler(timezone=tz)
     _scheduler.add_job(create_backup_zip, "cron", hour=3, minute=30, id="daily_backup")
+    # Compacta el log de votaciones (ediciones append-only) tras el backup
+    from ..repo import votaciones as votaciones_repo
+    _scheduler.add_job(votaciones_repo.compactar_votaciones, "cron", hour=3, minute=45, id="compactar_votaciones")
     _scheduler.start()
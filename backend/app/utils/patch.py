@@ -0,0 +1,14 @@
+from typing import AbstractSet, Any, Dict, Optional
+
+from pydantic import BaseModel
+
+
+def patch_dict(m: BaseModel, keys: Optional[AbstractSet[str]] = None) -> Dict[str, Any]:
+    """Campos enviados por el cliente y distintos de None.
+
+    Equivale a ``model_dump(exclude_none=True, exclude_unset=True)`` para
+    modelos planos, pero solo recorre ``__pydantic_fields_set__`` y no pasa
+    por el serializador. Con ``keys`` se limita además a esa lista permitida.
+    """
+    campos = m.__pydantic_fields_set__ if keys is None else m.__pydantic_fields_set__ & keys
+    return {k: v for k in campos if (v := getattr(m, k)) is not None}
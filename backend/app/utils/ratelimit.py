@@ -1,29 +1,126 @@
 from __future__ import annotations
 
+import logging
+import threading
 import time
-from typing import Dict, Tuple
+from typing import Dict, List
 from fastapi import HTTPException, Request, status
 
-# Ventana deslizante en memoria (por proceso)
-_BUCKETS: Dict[Tuple[str, str], list] = {}  # (scope, key) -> [timestamps]
-
-def _hit(scope: str, key: str, limit: int, window_s: int) -> None:
-    now = time.time()
-    bucket = _BUCKETS.setdefault((scope, key), [])
-    # limpia entradas fuera de ventana
-    cutoff = now - window_s
-    while bucket and bucket[0] < cutoff:
-        bucket.pop(0)
-    if len(bucket) >= limit:
-        raise HTTPException(
-            status_code=status.HTTP_429_TOO_MANY_REQUESTS,
-            detail=f"Rate limit excedido para {scope}. Inténtalo más tarde.",
+try:
+    # Opcional (si está instalado y hay REDIS_URL): límite común a todos los workers.
+    # Cliente asíncrono: los limitadores se llaman desde handlers async y no
+    # deben bloquear el event loop con el round-trip a Redis.
+    import redis
+    import redis.asyncio as aioredis
+except Exception:  # pragma: no cover
+    redis = None  # type: ignore
+    aioredis = None  # type: ignore
+
+from ..config import settings
+
+logger = logging.getLogger(__name__)
+
+# Token bucket en memoria (por proceso): capacidad = limit, recarga limit/window_s
+# por segundo. Un float y un instante por clave, comprobación O(1).
+# scope -> key -> [tokens, last_ns]: anidado para no crear una tupla (scope, key)
+# por petición; los scopes son literales del código, ya internados.
+_BUCKETS: Dict[str, Dict[str, List[float]]] = {}
+_LOCK = threading.Lock()  # los handlers síncronos corren en el threadpool
+
+# Instantes en ns de time.monotonic_ns(): inmune a saltos del reloj (NTP) y
+# comparaciones enteras en la limpieza.
+_NS = 1_000_000_000
+
+# Limpieza periódica de buckets ya llenos (equivalen a no tener entrada)
+_SWEEP_EVERY_NS = 60 * _NS
+_next_sweep = 0
+_max_window_ns = 0
+
+def _sweep(now: int) -> None:
+    global _next_sweep
+    _next_sweep = now + _SWEEP_EVERY_NS
+    # Tras una ventana completa sin uso cualquier bucket se ha recargado entero
+    cutoff = now - _max_window_ns
+    for por_key in _BUCKETS.values():
+        for k in [k for k, (_, last) in por_key.items() if last < cutoff]:
+            del por_key[k]
+
+# Mensaje del 429 por scope, formateado una sola vez. La excepción se crea en
+# cada rechazo: una instancia compartida acumularía __traceback__ entre hilos.
+_RL_DETAIL: Dict[str, str] = {}
+
+def _rl_exc(scope: str) -> HTTPException:
+    detail = _RL_DETAIL.get(scope)
+    if detail is None:
+        detail = _RL_DETAIL[scope] = f"Rate limit excedido para {scope}. Inténtalo más tarde."
+    return HTTPException(status_code=status.HTTP_429_TOO_MANY_REQUESTS, detail=detail)
+
+_redis_client = None
+# Tras un fallo de Redis se usa solo el bucket local durante un rato, para no
+# pagar el timeout en cada petición mientras Redis siga caído
+_REDIS_BACKOFF_S = 30.0
+_redis_off_until = 0.0
+
+def _redis():
+    global _redis_client
+    if aioredis is None or not settings.redis_url or time.monotonic() < _redis_off_until:
+        return None
+    if _redis_client is None:
+        # Timeout corto: si Redis no responde se usa el contador en memoria
+        _redis_client = aioredis.Redis.from_url(
+            settings.redis_url, socket_timeout=0.2, socket_connect_timeout=0.2
         )
-    bucket.append(now)
+    return _redis_client
+
+async def _hit_redis(r, scope: str, key: str, limit: int, window_s: int) -> None:
+    # Ventana fija: INCR + EXPIRE en un único round-trip
+    k = f"rl:{scope}:{key}:{int(time.time()) // window_s}"
+    pipe = r.pipeline()
+    pipe.incr(k)
+    pipe.expire(k, window_s)
+    count = (await pipe.execute())[0]
+    if count > limit:
+        raise _rl_exc(scope)
+
+async def _hit(scope: str, key: str, limit: int, window_s: int) -> None:
+    global _redis_off_until
+    r = _redis()
+    if r is not None:
+        try:
+            await _hit_redis(r, scope, key, limit, window_s)
+            return
+        except redis.RedisError:
+            _redis_off_until = time.monotonic() + _REDIS_BACKOFF_S
+            logger.warning("Redis no disponible para rate limit; bucket local durante %.0f s", _REDIS_BACKOFF_S, exc_info=True)
+    _hit_local(scope, key, limit, window_s)
+
+def _hit_local(scope: str, key: str, limit: int, window_s: int) -> None:
+    global _max_window_ns
+    now = time.monotonic_ns()
+    window_ns = window_s * _NS
+    rate = limit / window_ns  # tokens por ns
+    with _LOCK:
+        if window_ns > _max_window_ns:
+            _max_window_ns = window_ns
+        if now >= _next_sweep:
+            _sweep(now)
+        por_key = _BUCKETS.get(scope)
+        if por_key is None:
+            por_key = _BUCKETS[scope] = {}
+        b = por_key.get(key)
+        if b is None:
+            b = por_key[key] = [float(limit), now]
+        # Se actualiza en sitio: sin tupla nueva ni segunda escritura en el dict
+        tokens = min(float(limit), b[0] + (now - b[1]) * rate)
+        b[1] = now
+        if tokens < 1.0:
+            b[0] = tokens
+            raise _rl_exc(scope)
+        b[0] = tokens - 1.0
 
-def limit_by_ip(req: Request, scope: str, limit: int, window_s: int) -> None:
+async def limit_by_ip(req: Request, scope: str, limit: int, window_s: int) -> None:
     ip = (req.client.host if req.client else "unknown") or "unknown"
-    _hit(scope, ip, limit, window_s)
+    await _hit(scope, ip, limit, window_s)
 
-def limit_by_key(key: str, scope: str, limit: int, window_s: int) -> None:
-    _hit(scope, key.lower().strip(), limit, window_s)
+async def limit_by_key(key: str, scope: str, limit: int, window_s: int) -> None:
+    await _hit(scope, key.lower().strip(), limit, window_s)
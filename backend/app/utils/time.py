@@ -1,17 +1,37 @@
-from datetime import datetime, timezone
+from datetime import datetime, timedelta, timezone
+from functools import lru_cache
+from typing import Optional
 from zoneinfo import ZoneInfo
 
 EUROPE_MADRID = ZoneInfo("Europe/Madrid")
+_HORA = timedelta(hours=1)
 
 def now_utc() -> datetime:
     return datetime.now(tz=timezone.utc)
 
+@lru_cache(maxsize=1024)
+def _madrid_offset(y: int, m: int, d: int, h: int) -> Optional[timedelta]:
+    """Offset de Madrid para una hora UTC, o None si hay un cambio de hora cerca.
+
+    Se exige el mismo offset en la hora anterior y la siguiente: así la hora
+    local resultante nunca es ambigua (fold) ni inexistente.
+    """
+    base = datetime(y, m, d, h, tzinfo=timezone.utc)
+    offs = {(base + k * _HORA).astimezone(EUROPE_MADRID).utcoffset() for k in (-1, 0, 1)}
+    return offs.pop() if len(offs) == 1 else None
+
 def to_europe_madrid(dt: datetime) -> datetime:
     if dt.tzinfo is None:
         dt = dt.replace(tzinfo=timezone.utc)
-    return dt.astimezone(EUROPE_MADRID)
+    u = dt if dt.tzinfo is timezone.utc else dt.astimezone(timezone.utc)
+    off = _madrid_offset(u.year, u.month, u.day, u.hour)
+    if off is None:
+        return dt.astimezone(EUROPE_MADRID)
+    return (u + off).replace(tzinfo=EUROPE_MADRID)
 
 def isoformat_utc(dt: datetime) -> str:
     if dt.tzinfo is None:
-        dt = dt.replace(tzinfo=timezone.utc)
+        return dt.replace(tzinfo=timezone.utc).isoformat()
+    if dt.tzinfo is timezone.utc:
+        return dt.isoformat()
     return dt.astimezone(timezone.utc).isoformat()
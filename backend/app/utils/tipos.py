@@ -0,0 +1,10 @@
+from typing import Annotated
+
+from pydantic import AfterValidator, EmailStr, StringConstraints
+
+# str recortado al validar (cuerpos y parámetros de ruta): los handlers ya no
+# necesitan llamar a .strip() sobre el mismo valor
+StrippedStr = Annotated[str, StringConstraints(strip_whitespace=True)]
+
+# Email ya en forma canónica (recortado y en minúsculas) tras validar el modelo
+EmailNorm = Annotated[EmailStr, AfterValidator(str.lower)]
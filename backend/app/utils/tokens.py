@@ -4,20 +4,37 @@ from __future__ import annotations
 import base64
 import hmac
 import hashlib
-import json
 import time
+from functools import lru_cache
 from typing import Any, Dict, Tuple
 
+import orjson
+
 from ..config import settings  # import relativo correcto
 
 
+try:
+    # Opcional: base64 con SIMD (misma API que el stdlib)
+    import pybase64 as _b64
+except Exception:  # pragma: no cover
+    _b64 = base64  # type: ignore
+
+
+def _b64url_encode_bytes(b: bytes) -> bytes:
+    return _b64.urlsafe_b64encode(b).rstrip(b"=")
+
+
 def _b64url_encode(b: bytes) -> str:
-    return base64.urlsafe_b64encode(b).rstrip(b"=").decode("utf-8")
+    return _b64url_encode_bytes(b).decode("ascii")
 
 
 def _b64url_decode(s: str) -> bytes:
-    padding = "=" * (-len(s) % 4)
-    return base64.urlsafe_b64decode((s + padding).encode("utf-8"))
+    # base64url es ASCII: se codifica primero y el padding se añade en bytes
+    b = s.encode("ascii")
+    pad = -len(b) % 4
+    if pad:
+        b += b"=" * pad
+    return _b64.urlsafe_b64decode(b)
 
 
 def _get_secret_value() -> str:
@@ -34,9 +51,38 @@ def _get_secret_value() -> str:
     )
 
 
-def _sign(msg: bytes, secret: bytes) -> str:
-    sig = hmac.new(secret, msg, hashlib.sha256).digest()
-    return _b64url_encode(sig)
+@lru_cache(maxsize=1)
+def _secret_bytes() -> bytes:
+    """Secreto ya codificado; settings no cambia en caliente."""
+    return _get_secret_value().encode("utf-8")
+
+
+@lru_cache(maxsize=1)
+def _hmac_proto() -> "hmac.HMAC":
+    """HMAC-SHA256 con la clave ya preparada (ipad/opad); se copia en cada firma."""
+    return hmac.new(_secret_bytes(), b"", hashlib.sha256)
+
+
+def _sign_raw(msg: bytes | bytearray) -> bytes:
+    """Digest HMAC-SHA256 crudo (32 bytes)."""
+    h = _hmac_proto().copy()
+    h.update(msg)
+    return h.digest()
+
+
+def _sign_b64(msg: bytes | bytearray) -> bytes:
+    return _b64url_encode_bytes(_sign_raw(msg))
+
+
+def _sign(msg: bytes) -> str:
+    return _sign_b64(msg).decode("ascii")
+
+
+# Cabecera fija (HS256): su base64url, con el punto separador, se calcula una vez
+_JWT_HEADER_B64 = _b64url_encode_bytes(b'{"alg":"HS256","typ":"JWT"}') + b"."
+_JWT_HEADER_PREFIX = _JWT_HEADER_B64.decode("ascii")
+# Longitud de la firma en base64url sin padding (32 bytes -> 43 caracteres)
+_SIG_B64_LEN = 43
 
 
 def create_token(
@@ -48,7 +94,6 @@ def create_token(
     """
     Crea un token tipo JWT (HS256) sin dependencias externas.
     """
-    header = {"alg": "HS256", "typ": "JWT"}
     now = int(time.time())
     ttl = int(ttl_seconds if ttl_seconds is not None else getattr(settings, "auth_token_ttl_seconds", 3600))
     payload: Dict[str, Any] = {
@@ -60,37 +105,76 @@ def create_token(
     if extra:
         payload.update(extra)
 
-    header_b64 = _b64url_encode(json.dumps(header, separators=(",", ":"), ensure_ascii=False).encode("utf-8"))
-    payload_b64 = _b64url_encode(json.dumps(payload, separators=(",", ":"), ensure_ascii=False).encode("utf-8"))
-    signing_input = f"{header_b64}.{payload_b64}".encode("utf-8")
+    # header.payload se construye una sola vez en bytes, se firma tal cual y
+    # se le añade la firma: sin ir y venir entre str y bytes
+    buf = bytearray(_JWT_HEADER_B64)
+    buf += _b64url_encode_bytes(orjson.dumps(payload))
+    sig = _sign_b64(buf)
+    buf += b"."
+    buf += sig
+    return buf.decode("ascii")
+
+
+# Payloads ya verificados: blake2b(token) -> (caduca_monotonic, exp, payload).
+# En un acierto solo se vuelve a comprobar 'exp'; nunca se guarda el token.
+_VERIFY_CACHE: Dict[bytes, Tuple[float, int, Dict[str, Any]]] = {}
+_VERIFY_CACHE_MAX = 10_000
+_VERIFY_CACHE_TTL_S = 30.0
 
-    secret = _get_secret_value().encode("utf-8")
-    signature_b64 = _sign(signing_input, secret)
 
-    return f"{header_b64}.{payload_b64}.{signature_b64}"
+def token_key(token: str) -> bytes:
+    """Clave de caché de un token: blake2b de 16 bytes (digest crudo, sin hex)."""
+    return hashlib.blake2b(token.encode("utf-8"), digest_size=16).digest()
 
 
-def verify(token: str) -> Tuple[bool, Dict[str, Any] | str]:
+def verify(token: str, key: bytes | None = None) -> Tuple[bool, Dict[str, Any] | str]:
     """
     Verifica firma y expiración. Devuelve (ok, payload | motivo).
+    ``key`` permite reutilizar un token_key(token) ya calculado por el llamador.
     """
+    # Basura evidente (sin las 3 partes): ni hash ni HMAC
+    if not token or token.count(".") != 2:
+        return False, "formato inválido"
+    if key is None:
+        key = token_key(token)
+    hit = _VERIFY_CACHE.get(key)
+    if hit is not None and hit[0] > time.monotonic():
+        exp = hit[1]
+        if exp and time.time() > exp:
+            return False, "token expirado"
+        return True, hit[2]
+
+    ok, data = _verify_uncached(token)
+    if ok:
+        if len(_VERIFY_CACHE) >= _VERIFY_CACHE_MAX:
+            # dict conserva el orden de inserción: fuera la entrada más antigua
+            _VERIFY_CACHE.pop(next(iter(_VERIFY_CACHE)), None)
+        _VERIFY_CACHE[key] = (time.monotonic() + _VERIFY_CACHE_TTL_S, data.get("exp") or 0, data)
+    return ok, data
+
+
+def _verify_uncached(token: str) -> Tuple[bool, Dict[str, Any] | str]:
     try:
-        parts = token.split(".")
-        if len(parts) != 3:
-            return False, "formato inválido"
-        header_b64, payload_b64, signature_b64 = parts
-
-        signing_input = f"{header_b64}.{payload_b64}".encode("utf-8")
-        secret = _get_secret_value().encode("utf-8")
-        expected_sig = _sign(signing_input, secret)
-        if not hmac.compare_digest(signature_b64, expected_sig):
+        # Solo emitimos HS256 con cabecera fija: cualquier otra se rechaza
+        # sin llegar a calcular el HMAC
+        if not token.startswith(_JWT_HEADER_PREFIX):
+            return False, "header inválido"
+        signing_input_str, _, signature_b64 = token.rpartition(".")
+        payload_b64 = signing_input_str[len(_JWT_HEADER_PREFIX):]
+
+        # Se comparan los digests crudos: sin codificar a base64 la firma esperada
+        if len(signature_b64) != _SIG_B64_LEN:
+            return False, "firma inválida"
+        expected = _sign_raw(signing_input_str.encode("utf-8"))
+        if not hmac.compare_digest(expected, _b64url_decode(signature_b64)):
             return False, "firma inválida"
 
         payload_raw = _b64url_decode(payload_b64)
-        payload = json.loads(payload_raw.decode("utf-8"))
+        payload = orjson.loads(payload_raw)
 
-        exp = int(payload.get("exp", 0))
-        if exp and int(time.time()) > exp:
+        # orjson ya devuelve 'exp' como int: sin int() ni truncar time.time()
+        exp = payload.get("exp")
+        if exp and time.time() > exp:
             return False, "token expirado"
 
         return True, payload